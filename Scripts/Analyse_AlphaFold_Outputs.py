@@ -6,90 +6,198 @@ sequence design application such as ProteinMPNN, ESM-IF1, or similar tools.
 
 It processes multiple PDB files in a given directory and computes:
 - The average pLDDT score across all residues.
-- The average pLDDT for the 5 residues with the lowest pLDDT scores.
+- The average pLDDT for the k residues with the lowest pLDDT scores (k = 5 by default).
 - The backbone RMSD (BB RMSD) compared to a reference PDB (optional),
-  using the updated RMSD.py script with the --backbone flag.
+  computed in-process with RMSD.py (the reference is parsed only once).
 
 If no reference PDB is provided, each structure is compared to itself for RMSD.
 The results are saved in a user-specified CSV file.
 
+The per-residue pLDDT of every model (CA B-factors, read from the fixed PDB
+columns by PDB_Parser) is also kept: the mean and minimum pLDDT of each residue
+across the batch are saved in per_residue_<output_csv>, and `--plddt-npy` saves
+the full (models x residues) float32 pLDDT matrix, one row per line of the
+output CSV. Models shorter than the longest one are padded with NaN.
+
 Author: Niayesh Zarifi
 
 Usage:
-    python Analyse_AlphaFold_Outputs.py <input_pdb_dir> <output_csv> [ref_pdb]
+    python Analyse_AlphaFold_Outputs.py <input_pdb_dir> <output_csv> [ref_pdb] [--jobs N]
+                                        [--k-lowest K] [--plddt-npy matrix.npy]
 
 Arguments:
     input_pdb_dir (str): Directory containing the generated PDB files.
     output_csv (str): Name of the output CSV file (must end in .csv).
     ref_pdb (str, optional): Reference PDB file for RMSD comparison.
                               If not provided, each PDB is compared to itself.
+    --jobs N (optional): Number of worker processes (0 = all cores, default: 1).
+    --k-lowest K (optional): Number of lowest pLDDT residues averaged in "min pLDDT" (default: 5).
+    --plddt-npy (optional): Save the (models x residues) float32 pLDDT matrix to this .npy file.
 """
 
 import os
 import sys
-import statistics
-import subprocess
+from functools import partial
+import numpy as np
+import PDB_Parser
+import Parallel
+import RMSD
 
-def calculate_backbone_rmsd(structure_pdb, reference_pdb):
-    """Calculate backbone RMSD using the updated RMSD.py script."""
-    try:
-        result = subprocess.run(["python", "RMSD.py", structure_pdb, reference_pdb, "--backbone"],
-                                capture_output=True, text=True, check=True)
-        rmsd_value = float(result.stdout.strip().split()[-2])  # Extract numeric RMSD value
-        return rmsd_value
-    except Exception as e:
-        print(f"Error calculating backbone RMSD: {e}")
+def calculate_backbone_rmsd(coords, reference_coords):
+    """Calculate backbone RMSD between two backbone coordinate arrays with RMSD.kabsch_rmsd."""
+    if len(coords) != len(reference_coords):
+        print(f"Error calculating backbone RMSD: {len(coords)} backbone atoms vs {len(reference_coords)} in the reference.")
         return None
+    return RMSD.kabsch_rmsd(coords, reference_coords)
+
+def residue_plddts(structure):
+    """Return (pLDDT of each residue as float32, 'chain:resnum+icode' residue labels) from the CA B-factors."""
+    ca = ~structure.hetero & (structure.name == 'CA')
+    labels = np.char.add(np.char.add(np.char.add(structure.chain[ca], ":"), structure.resnum[ca].astype(str)),
+                         structure.icode[ca])
+    return structure.bfactor[ca].astype(np.float32), labels
+
+def k_lowest_mean(values, k=5):
+    """Mean of the k lowest values, selected with np.partition instead of a full sort."""
+    k = min(k, len(values))
+    return float(np.partition(values, k - 1)[:k].mean(dtype=np.float64))
 
-def analyze_af_outputs(input_pdb_dir, output_csv, ref_pdb=None):
-    """Analyzes multiple AlphaFold output PDBs, calculates pLDDT metrics, and backbone RMSD."""
+def analyze_pdb(input_pdb_path, reference_coords=None, k_lowest=5):
+    """Compute the CSV row (pLDDT metrics and backbone RMSD) for one PDB file, or None if it is skipped."""
+    return analyze_pdb_profile(input_pdb_path, reference_coords, k_lowest)[0]
+
+def analyze_pdb_profile(input_pdb_path, reference_coords=None, k_lowest=5):
+    """Return (CSV row or None if the file is skipped, per-residue pLDDTs, residue labels) for one PDB file.
+
+    Without `reference_coords`, the reference registered as shared data by
+    analyze_af_outputs is used, and failing that the structure itself."""
+    pdbfile = os.path.basename(input_pdb_path)
+    
+    # pLDDT is stored in the B-factor column of the CA atoms
+    structure = PDB_Parser.read_structure(input_pdb_path)
+    plddts, labels = residue_plddts(structure)
+    
+    if len(plddts):
+        avg = round(float(plddts.mean(dtype=np.float64)), 2)
+        median = round(float(np.median(plddts.astype(np.float64))), 2)
+        avg_min = round(k_lowest_mean(plddts, k_lowest), 2)
+    else:
+        print(f"Warning: No valid pLDDT values found in {pdbfile}. Skipping...")
+        return None, plddts, labels
+    
+    backbone = structure.coords[PDB_Parser.backbone_mask(structure)].astype(float)
+    if reference_coords is None:
+        reference_coords = Parallel.shared("reference_coords")
+    if reference_coords is None:
+        reference_coords = backbone
+    bb_rmsd = calculate_backbone_rmsd(backbone, reference_coords)
+    
+    if bb_rmsd is None:
+        return None, plddts, labels
+    return f"{pdbfile},{avg},{median},{avg_min},{round(bb_rmsd,2)}\n", plddts, labels
+
+def plddt_matrix(profiles):
+    """Stack per-residue pLDDT vectors into a (models x residues) float32 matrix, NaN-padding shorter models."""
+    n_residues = max((len(plddts) for plddts in profiles), default=0)
+    matrix = np.full((len(profiles), n_residues), np.nan, dtype=np.float32)
+    for row, plddts in enumerate(profiles):
+        matrix[row, :len(plddts)] = plddts
+    return matrix
+
+def write_residue_profile(matrix, labels, output_csv):
+    """Write the mean and minimum pLDDT of every residue position across the models (header only if there are none)."""
+    with open(output_csv, "w") as f:
+        f.write("residue,label,mean pLDDT,min pLDDT,models\n")
+        if matrix.size == 0:
+            return
+        # every column holds at least the longest model, so the NaN-aware reductions never see an all-NaN column
+        counts = np.sum(~np.isnan(matrix), axis=0)
+        means = np.nanmean(matrix, axis=0, dtype=np.float64)
+        minima = np.nanmin(matrix, axis=0)
+        for index in range(matrix.shape[1]):
+            f.write(f"{index + 1},{labels[index]},{round(float(means[index]), 2)},{round(float(minima[index]), 2)},{counts[index]}\n")
+
+def analyze_af_outputs(input_pdb_dir, output_csv, ref_pdb=None, jobs=1, k_lowest=5, plddt_npy=None):
+    """Analyzes multiple AlphaFold output PDBs, calculates pLDDT metrics, and backbone RMSD.
+
+    Also writes the per-residue mean/min pLDDT to per_residue_<output_csv> and, if `plddt_npy`
+    is given, saves the (models x residues) pLDDT matrix with rows in output CSV order."""
     
     if not output_csv.endswith(".csv"):
         print("Error: Output file must have a .csv extension.")
         sys.exit(1)
     
+    if k_lowest < 1:
+        print("Error: --k-lowest must be at least 1.")
+        sys.exit(1)
+    
     if not os.path.isdir(input_pdb_dir):
         print("Error: The input must be a directory containing PDB files.")
         sys.exit(1)
     
+    pdb_paths = [os.path.join(input_pdb_dir, pdbfile) for pdbfile in os.listdir(input_pdb_dir)]
+    pdb_paths = [path for path in pdb_paths if os.path.isfile(path) and PDB_Parser.is_structure_file(path)]
+    
+    # parse the reference once; workers share it instead of re-reading it per model
+    reference_coords = RMSD.parse_pdb(ref_pdb, backbone_only=True) if ref_pdb else None
+    
+    profiles = []
+    labels = np.empty(0, dtype=str)
+    analyze = partial(analyze_pdb_profile, k_lowest=k_lowest)
     with open(output_csv, "w") as f:
         f.write("pdbfile,average pLDDT,median pLDDT,min pLDDT,backbone RMSD\n")
+        # rows come back in directory order whatever the number of jobs
+        for row, plddts, residues in Parallel.imap_ordered(analyze, pdb_paths, jobs=jobs,
+                                                           shared={"reference_coords": reference_coords}):
+            if row is not None:
+                f.write(row)
+                profiles.append(plddts)
+                if len(residues) > len(labels):
+                    labels = residues
     
-    for pdbfile in os.listdir(input_pdb_dir):
-        input_pdb_path = os.path.join(input_pdb_dir, pdbfile)
-        
-        if os.path.isfile(input_pdb_path) and pdbfile.endswith(".pdb"):
-            plddts = []
-            
-            with open(input_pdb_path, 'r') as infile:
-                for line in infile:
-                    tokens = line.split()
-                    if len(tokens) > 10 and tokens[2] == 'CA':
-                        plddts.append(float(tokens[10]))
-            
-            if plddts:
-                avg = round(statistics.mean(plddts), 2)
-                median = round(statistics.median(plddts), 2)
-                avg_min = round(sum(sorted(plddts)[:5]) / 5, 2)
-            else:
-                print(f"Warning: No valid pLDDT values found in {pdbfile}. Skipping...")
-                continue
-            
-            reference_pdb = ref_pdb if ref_pdb else input_pdb_path
-            bb_rmsd = calculate_backbone_rmsd(input_pdb_path, reference_pdb)
-            
-            if bb_rmsd is not None:
-                with open(output_csv, "a") as f:
-                    f.write(f"{pdbfile},{avg},{median},{avg_min},{round(bb_rmsd,2)}\n")
+    matrix = plddt_matrix(profiles)
+    directory, name = os.path.split(output_csv)
+    write_residue_profile(matrix, labels, os.path.join(directory, "per_residue_" + name))
+    if plddt_npy and not profiles:
+        print(f"Warning: No model produced a pLDDT profile; {plddt_npy} was not written.")
+    elif plddt_npy:
+        np.save(plddt_npy, matrix)
+
+def option_value(options, flag, default=None):
+    """Return the value following `flag` in the command line options, or `default`."""
+    if flag not in options:
+        return default
+    index = options.index(flag)
+    if index + 1 >= len(options):
+        print(f"Error: {flag} requires a value.")
+        sys.exit(1)
+    return options[index + 1]
+
+def strip_options(arguments, flags):
+    """Return the arguments without the given `--flag value` options."""
+    arguments = list(arguments)
+    for flag in flags:
+        if flag in arguments:
+            index = arguments.index(flag)
+            del arguments[index:index + 2]
+    return arguments
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python Analyse_AlphaFold_Outputs.py <input_pdb_dir> <output_csv> [ref_pdb]")
+    arguments = strip_options(Parallel.strip_jobs_option(sys.argv), ("--k-lowest", "--plddt-npy"))
+    if len(arguments) < 3:
+        print("Usage: python Analyse_AlphaFold_Outputs.py <input_pdb_dir> <output_csv> [ref_pdb] [--jobs N] "
+              "[--k-lowest K] [--plddt-npy matrix.npy]")
         sys.exit(1)
     
-    input_pdb_dir = sys.argv[1]
-    output_csv = sys.argv[2]
-    ref_pdb = sys.argv[3] if len(sys.argv) > 3 else None
+    input_pdb_dir = arguments[1]
+    output_csv = arguments[2]
+    ref_pdb = arguments[3] if len(arguments) > 3 else None
+    jobs = Parallel.jobs_from_options(sys.argv)
+    try:
+        k_lowest = int(option_value(sys.argv, "--k-lowest", 5))
+    except ValueError:
+        print("Error: --k-lowest must be an integer.")
+        sys.exit(1)
+    plddt_npy = option_value(sys.argv, "--plddt-npy")
     
-    analyze_af_outputs(input_pdb_dir, output_csv, ref_pdb)
-
+    analyze_af_outputs(input_pdb_dir, output_csv, ref_pdb, jobs, k_lowest, plddt_npy)
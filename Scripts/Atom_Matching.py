@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""
+Residue-Aware Atom Matching
+===========================
+Builds the atom correspondence between a reference structure and a model from
+atom identities instead of relying on both files listing the same atoms in the
+same order. Used by RMSD.py and Calculate_Deviation_Diversity_Ens.py
+(`--match <mode>`).
+
+Atoms are identified by (chain, residue number, insertion code, atom name).
+Three matching modes are available:
+
+    strict        : model and reference must contain exactly the same atoms
+                    (any order); otherwise a MatchError is raised
+    intersection  : only the atoms present in both structures are used
+    align         : residues are paired by a global sequence alignment
+                    (Needleman-Wunsch on residue names, per chain when the chain
+                    IDs agree), then atoms of paired residues are matched by name;
+                    for models with different numbering or sequences
+
+A mapping depends only on the model topology, so an AtomMapper computes it once
+per distinct topology and reuses it for every model sharing it (all models of
+an AlphaFold run, every frame of a trajectory): matching adds no per-pair cost.
+
+Usage:
+------
+    import Atom_Matching
+    mapper = Atom_Matching.AtomMapper(reference_structure, mode="intersection")
+    ref_to_model = mapper.lookup(model_structure)   # -1 where the model lacks an atom
+    present = ref_to_model >= 0
+    P, Q = reference_structure.coords[present], model_structure.coords[ref_to_model[present]]
+"""
+
+import hashlib
+import numpy as np
+
+
+MATCH_MODES = ("strict", "intersection", "align")
+
+# Needleman-Wunsch scores (identical residue names, different names, gap)
+MATCH_SCORE = 2
+MISMATCH_SCORE = -1
+GAP_PENALTY = 2
+
+
+class MatchError(ValueError):
+    """Raised when a model cannot be matched onto the reference atoms."""
+
+
+def residue_labels(structure):
+    """Return 'chain:resnum+icode' residue identifiers for every atom, e.g. 'A:52A'."""
+    return np.char.add(np.char.add(np.char.add(structure.chain, ":"), structure.resnum.astype(str)),
+                       structure.icode)
+
+
+def atom_identities(structure, labels=None):
+    """Return 'chain:resnum+icode:name' identifiers for every atom (optionally with replaced residue labels)."""
+    labels = residue_labels(structure) if labels is None else labels
+    return np.char.add(np.char.add(labels, ":"), structure.name)
+
+
+def residue_index(structure):
+    """Return (first atom of each residue, residue number of each atom), residues in sequence order.
+
+    Sequence order is chain (in order of appearance), residue number, insertion code."""
+    _, first, inverse = np.unique(residue_labels(structure), return_index=True, return_inverse=True)
+    chains, chain_first = np.unique(structure.chain, return_index=True)
+    chain_order = np.argsort(np.argsort(chain_first))[np.searchsorted(chains, structure.chain[first])]
+    order = np.lexsort((structure.icode[first], structure.resnum[first], chain_order))
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return first[order], rank[inverse]
+
+
+def align_sequences(codes_A, codes_B):
+    """Global alignment of two integer-coded sequences; returns the aligned (index_A, index_B) pairs.
+
+    Each DP row is computed with NumPy: the horizontal gap recursion
+    H[i, j] = max(D[j], H[i, j - 1] - gap) is a running maximum of D[k] + gap * k."""
+    n_A, n_B = len(codes_A), len(codes_B)
+    steps = GAP_PENALTY * np.arange(n_B + 1)
+    H = np.empty((n_A + 1, n_B + 1), dtype=np.int64)
+    H[0] = -steps
+    for i in range(1, n_A + 1):
+        scores = np.where(codes_B == codes_A[i - 1], MATCH_SCORE, MISMATCH_SCORE)
+        D = np.empty(n_B + 1, dtype=np.int64)
+        D[0] = -GAP_PENALTY * i
+        D[1:] = np.maximum(H[i - 1, :-1] + scores, H[i - 1, 1:] - GAP_PENALTY)
+        H[i] = np.maximum.accumulate(D + steps) - steps
+
+    pairs = []
+    i, j = n_A, n_B
+    while i > 0 and j > 0:
+        score = MATCH_SCORE if codes_A[i - 1] == codes_B[j - 1] else MISMATCH_SCORE
+        if H[i, j] == H[i - 1, j - 1] + score:
+            pairs.append((i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif H[i, j] == H[i - 1, j] - GAP_PENALTY:
+            i -= 1
+        else:
+            j -= 1
+    pairs.reverse()
+    return pairs
+
+
+def aligned_labels(reference, model):
+    """Relabel the model residues with the reference residues they align to ('' where unaligned)."""
+    ref_starts, _ = residue_index(reference)
+    model_starts, residue_of_atom = residue_index(model)
+    ref_chains = reference.chain[ref_starts]
+    model_chains = model.chain[model_starts]
+    _, codes = np.unique(np.concatenate([reference.resname[ref_starts], model.resname[model_starts]]),
+                         return_inverse=True)
+    ref_codes, model_codes = codes[:len(ref_starts)], codes[len(ref_starts):]
+
+    # align chain by chain when both structures use the same chain IDs, else the whole sequences
+    if set(ref_chains) == set(model_chains):
+        segments = [(np.flatnonzero(ref_chains == chain), np.flatnonzero(model_chains == chain))
+                    for chain in dict.fromkeys(ref_chains)]
+    else:
+        segments = [(np.arange(len(ref_starts)), np.arange(len(model_starts)))]
+
+    ref_residue_labels = residue_labels(reference)[ref_starts]
+    model_residue_labels = np.full(len(model_starts), "", dtype=ref_residue_labels.dtype)
+    for ref_residues, model_residues in segments:
+        for i, j in align_sequences(ref_codes[ref_residues], model_codes[model_residues]):
+            model_residue_labels[model_residues[j]] = ref_residue_labels[ref_residues[i]]
+    return model_residue_labels[residue_of_atom]
+
+
+def topology_signature(structure):
+    """Digest of the atom identities and residue names; models with equal signatures share a mapping."""
+    digest = hashlib.sha1(atom_identities(structure).tobytes())
+    digest.update(structure.resname.tobytes())
+    return digest.digest()
+
+
+class AtomMapper:
+    """Maps model atoms onto the atoms of a reference structure, caching one mapping per model topology."""
+
+    def __init__(self, reference, mode="intersection"):
+        if mode not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode '{mode}' (expected one of {', '.join(MATCH_MODES)})")
+        self.reference = reference
+        self.mode = mode
+        self.reference_ids = atom_identities(reference)
+        self.mappings = {}
+
+    def compute(self, model):
+        """Index of the matching model atom for every reference atom (-1 where there is none)."""
+        if self.mode == "align":
+            model_ids = atom_identities(model, aligned_labels(self.reference, model))
+        else:
+            model_ids = atom_identities(model)
+        _, ref_index, model_index = np.intersect1d(self.reference_ids, model_ids, return_indices=True)
+        ref_to_model = np.full(len(self.reference_ids), -1, dtype=np.int64)
+        ref_to_model[ref_index] = model_index
+
+        if self.mode == "strict" and (len(ref_index) != len(np.unique(self.reference_ids))
+                                      or len(model_index) != len(np.unique(model_ids))):
+            missing = self.reference_ids[ref_to_model < 0]
+            extra = np.setdiff1d(model_ids, self.reference_ids)
+            raise MatchError(f"{len(missing)} reference atoms missing from the model (e.g. {', '.join(missing[:3])}), "
+                             f"{len(extra)} model atoms not in the reference (e.g. {', '.join(extra[:3])})")
+        if not len(ref_index):
+            raise MatchError("No atoms in common with the reference")
+        return ref_to_model
+
+    def lookup(self, model):
+        """Cached mapping for the topology of `model` (see compute)."""
+        signature = topology_signature(model)
+        if signature not in self.mappings:
+            try:
+                self.mappings[signature] = self.compute(model)
+            except MatchError as e:
+                self.mappings[signature] = e
+        mapping = self.mappings[signature]
+        if isinstance(mapping, MatchError):
+            raise mapping
+        return mapping
+
+    def pair(self, model):
+        """Return matched (reference_coords, model_coords) arrays in reference atom order."""
+        ref_to_model = self.lookup(model)
+        present = ref_to_model >= 0
+        return self.reference.coords[present], model.coords[ref_to_model[present]]
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+"""
+Atom Selection Language
+=======================
+Small selection grammar shared by RMSD.py, Calculate_Deviation_Diversity_Ens.py
+and Process_PDB.py (`--select "<expression>"`). An expression is compiled once
+into a tree of NumPy operations over the parsed columns of PDB_Parser, so
+evaluating it on a structure is a handful of vectorized comparisons instead of
+per-line string tests.
+
+Grammar:
+--------
+    expression := term ("or" term)*
+    term       := factor ("and" factor)*
+    factor     := "not" factor | "(" expression ")" | selector
+
+Selectors:
+    all, none
+    protein        ATOM records of standard amino acids
+    backbone       protein backbone atoms (N, CA, C, O)
+    sidechain      protein atoms that are not main-chain atoms (N, CA, C, O, OXT and the
+                   amide and alpha hydrogens H, H1, H2, H3, HA, HA2, HA3)
+    hetero         HETATM records
+    water          water molecules (HOH, WAT)
+    hydrogen       hydrogen and deuterium atoms (element H or D)
+    chain A B ...            chain identifiers
+    resid 10 20-30 -5 ...    residue numbers and inclusive ranges (all insertion codes)
+    resname ALA PHE ...      residue names
+    name CA CB ...           atom names
+    element C N ...          element symbols
+    altloc A ...             alternate location indicators
+
+Value lists end at the next operator, selector or parenthesis. Operators and
+selectors are case-insensitive; values are case-sensitive.
+
+Examples:
+---------
+    "backbone and chain A"
+    "protein and not hydrogen and not resid 1-5"
+    "(resname PHE TYR TRP and sidechain) or (hetero and not water)"
+
+Usage:
+------
+    import Atom_Selection
+    selection = Atom_Selection.compile_selection("backbone and chain A")
+    mask = selection.mask(structure)           # boolean array over the atoms
+    subset = selection.select(structure)       # Structure restricted to the atoms
+"""
+
+import re
+from functools import lru_cache
+import numpy as np
+import PDB_Parser
+
+
+AMINO_ACIDS = ("ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS", "ILE",
+               "LEU", "LYS", "MET", "PHE", "PRO", "SER", "THR", "TRP", "TYR", "VAL",
+               "MSE", "SEC", "PYL", "HID", "HIE", "HIP", "CYX", "ASH", "GLH", "LYN")
+WATER_RESIDUES = ("HOH", "WAT")
+# HA2/HA3: glycine alpha hydrogens; H1-H3: N-terminal amine hydrogens
+MAIN_CHAIN_ATOMS = PDB_Parser.BACKBONE_ATOMS + ("OXT", "H", "H1", "H2", "H3", "HA", "HA2", "HA3")
+
+_TOKEN_PATTERN = re.compile(r"\(|\)|[^\s()]+")
+_RANGE_PATTERN = re.compile(r"^(-?\d+)(?:[-:](-?\d+))?$")
+
+_OPERATORS = ("and", "or", "not")
+
+
+def _is_protein(structure):
+    return ~structure.hetero & np.isin(structure.resname, AMINO_ACIDS)
+
+
+_SELECTORS = {
+    "all": lambda structure: np.ones(len(structure), dtype=bool),
+    "none": lambda structure: np.zeros(len(structure), dtype=bool),
+    "protein": _is_protein,
+    "backbone": PDB_Parser.backbone_mask,
+    "sidechain": lambda structure: _is_protein(structure) & ~np.isin(structure.name, MAIN_CHAIN_ATOMS),
+    "hetero": lambda structure: structure.hetero.copy(),
+    "water": lambda structure: np.isin(structure.resname, WATER_RESIDUES),
+    "hydrogen": lambda structure: np.isin(structure.element, ("H", "D")),
+}
+
+# selectors taking a list of values, and the column they compare against
+_VALUE_SELECTORS = {
+    "chain": "chain",
+    "resname": "resname",
+    "name": "name",
+    "element": "element",
+    "altloc": "altloc",
+    "resid": "resnum",
+}
+
+
+class SelectionError(ValueError):
+    """Raised for a malformed selection expression."""
+
+
+def _resid_selector(values):
+    """Compile residue numbers and ranges into one vectorized interval test."""
+    bounds = []
+    for value in values:
+        match = _RANGE_PATTERN.match(value)
+        if not match:
+            raise SelectionError(f"Invalid residue number or range: '{value}'")
+        start = int(match.group(1))
+        stop = int(match.group(2)) if match.group(2) is not None else start
+        bounds.append((min(start, stop), max(start, stop)))
+    starts, stops = np.array(bounds).T
+
+    def selector(structure):
+        resnum = structure.resnum[:, None]
+        return ((resnum >= starts) & (resnum <= stops)).any(axis=1)
+    return selector
+
+
+def _value_selector(keyword, values):
+    """Compile `keyword value ...` into a membership test on one column."""
+    if keyword == "resid":
+        return _resid_selector(values)
+    column = _VALUE_SELECTORS[keyword]
+    values = np.array(values)
+    return lambda structure: np.isin(getattr(structure, column), values)
+
+
+class _Parser:
+    """Recursive-descent parser turning tokens into a tree of mask functions."""
+
+    def __init__(self, text):
+        self.tokens = _TOKEN_PATTERN.findall(text)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def is_reserved(self, token):
+        return token in ("(", ")") or token.lower() in _OPERATORS + tuple(_SELECTORS) + tuple(_VALUE_SELECTORS)
+
+    def parse(self):
+        if not self.tokens:
+            raise SelectionError("Empty selection")
+        expression = self.expression()
+        if self.peek() is not None:
+            raise SelectionError(f"Unexpected '{self.peek()}' in selection")
+        return expression
+
+    def expression(self):
+        operands = [self.term()]
+        while self.peek() is not None and self.peek().lower() == "or":
+            self.take()
+            operands.append(self.term())
+        if len(operands) == 1:
+            return operands[0]
+        return lambda structure: np.logical_or.reduce([operand(structure) for operand in operands])
+
+    def term(self):
+        operands = [self.factor()]
+        while self.peek() is not None and self.peek().lower() == "and":
+            self.take()
+            operands.append(self.factor())
+        if len(operands) == 1:
+            return operands[0]
+        return lambda structure: np.logical_and.reduce([operand(structure) for operand in operands])
+
+    def factor(self):
+        token = self.take()
+        if token is None:
+            raise SelectionError("Selection ends unexpectedly")
+        keyword = token.lower()
+        if keyword == "not":
+            operand = self.factor()
+            return lambda structure: ~operand(structure)
+        if token == "(":
+            expression = self.expression()
+            if self.take() != ")":
+                raise SelectionError("Missing ')' in selection")
+            return expression
+        if keyword in _SELECTORS:
+            return _SELECTORS[keyword]
+        if keyword in _VALUE_SELECTORS:
+            values = []
+            while self.peek() is not None and not self.is_reserved(self.peek()):
+                values.append(self.take())
+            if not values:
+                raise SelectionError(f"'{keyword}' needs at least one value")
+            return _value_selector(keyword, values)
+        raise SelectionError(f"Unknown selection keyword '{token}'")
+
+
+class Selection:
+    """A compiled selection expression."""
+
+    def __init__(self, text):
+        self.text = text
+        self.evaluate = _Parser(text).parse()
+
+    def mask(self, structure):
+        """Boolean mask of the selected atoms of a Structure."""
+        return np.asarray(self.evaluate(structure), dtype=bool)
+
+    def select(self, structure):
+        """Return the Structure restricted to the selected atoms."""
+        return structure.select(self.mask(structure))
+
+    def __repr__(self):
+        return f"Selection({self.text!r})"
+
+
+@lru_cache(maxsize=128)
+def compile_selection(text):
+    """Compile a selection expression (cached, so repeated use costs nothing); raises SelectionError."""
+    return Selection(text)
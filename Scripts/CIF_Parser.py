@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+"""
+Columnar mmCIF Parser
+=====================
+Reads the `_atom_site` loop of mmCIF/PDBx files into the same Structure column
+arrays as PDB_Parser, so every script accepts .cif files (compressed or not)
+wherever it accepts PDB files. mmCIF has none of the PDB format limits: chain
+IDs may have several characters and there is no cap on the number of atoms.
+
+The loop body is tokenized in bulk: whitespace boundaries are located with
+NumPy over the raw bytes, and each needed column is gathered from the token
+offsets into a fixed-width byte matrix, which is converted with one array
+operation (text columns are widened to Unicode code points, numbers use
+astype). No Python code runs per atom, except for the rare files whose quoted
+values contain spaces, which go through a regular-expression tokenizer.
+
+Columns used (author fields are preferred, as they match the PDB files):
+
+    group_PDB                         -> hetero
+    id                                -> serial
+    auth_atom_id / label_atom_id      -> name
+    label_alt_id                      -> altloc
+    auth_comp_id / label_comp_id      -> resname
+    auth_asym_id / label_asym_id      -> chain
+    auth_seq_id / label_seq_id        -> resnum
+    pdbx_PDB_ins_code                 -> icode
+    Cartn_x, Cartn_y, Cartn_z         -> coords
+    occupancy                         -> occupancy
+    B_iso_or_equiv                    -> bfactor
+    type_symbol                       -> element
+    pdbx_PDB_model_num                -> model
+
+Missing values ('?' and '.') become empty strings or 0. Only the first
+atom_site loop of a file (its first data block) is read.
+
+Usage:
+------
+    Use PDB_Parser.read_structure("1abc.cif.gz") / PDB_Parser.iter_models(...),
+    which dispatch .cif/.mmcif files here; or directly:
+
+    import CIF_Parser
+    structure = CIF_Parser.parse_cif(open("1abc.cif", "rb").read())
+"""
+
+import re
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import PDB_Parser
+
+
+_FIELD_PREFIX = b"_atom_site."
+# a loop ends at the next comment, loop, data item or data block
+_LOOP_TERMINATORS = (b"\n#", b"\nloop_", b"\n_", b"\ndata_")
+# CIF quoted values end at a quote followed by whitespace
+_TOKEN_PATTERN = re.compile(rb"'(.*?)'(?=\s|$)|\"(.*?)\"(?=\s|$)|(\S+)", re.M)
+_ALL_BYTES = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def _find_loop(data):
+    """Return (column names, loop body bytes) of the first atom_site loop, or None.
+
+    Located with plain bytes.find() calls: a multi-line regular expression would
+    scan the whole (often tens of MB) file in Python's regex engine."""
+    first_field = data.find(b"\n" + _FIELD_PREFIX)
+    if first_field == -1:
+        return None
+    if not data[:first_field].rstrip().endswith(b"loop_"):
+        raise ValueError("atom_site is not a loop (single-atom mmCIF files are not supported)")
+    fields = []
+    position = first_field + 1
+    while data.startswith(_FIELD_PREFIX, position):
+        line_end = data.find(b"\n", position)
+        line_end = len(data) if line_end == -1 else line_end
+        fields.append(data[position + len(_FIELD_PREFIX):line_end].strip().decode())
+        position = line_end + 1
+    if data.startswith(tuple(terminator[1:] for terminator in _LOOP_TERMINATORS), position):
+        return fields, b""
+    # data rows rarely start with '#', 'l', '_' or 'd': check only the lines that do
+    rest = np.frombuffer(data, dtype=np.uint8, offset=min(position, len(data)))
+    newlines = np.flatnonzero(rest[:-1] == ord("\n"))
+    candidates = newlines[np.isin(rest[newlines + 1], np.frombuffer(b"#l_d", dtype=np.uint8))]
+    end = len(data)
+    for candidate in candidates + position:
+        if data.startswith(_LOOP_TERMINATORS, candidate):
+            end = candidate
+            break
+    return fields, data[position:end]
+
+
+def _tokenize(body):
+    """Return (bytes array, token starts, token ends) for a loop body, quotes removed.
+
+    The array is padded with zeros so that every token can be read as a window
+    of the longest token length."""
+    buf = np.frombuffer(body, dtype=np.uint8)
+    text = buf > ord(" ")  # space, tab, CR and LF separate the values
+    # token boundaries alternate: start, end, start, end, ...
+    boundaries = np.flatnonzero(text[1:] != text[:-1]) + 1
+    if len(text) and text[0]:
+        boundaries = np.concatenate([[0], boundaries])
+    if len(text) and text[-1]:
+        boundaries = np.concatenate([boundaries, [len(text)]])
+    starts, ends = boundaries[0::2], boundaries[1::2]
+
+    first = buf[starts]
+    quoted = np.flatnonzero((first == ord("'")) | (first == ord('"')))
+    if len(quoted):
+        closed = (ends[quoted] - starts[quoted] >= 2) & (buf[ends[quoted] - 1] == first[quoted])
+        if closed.all():
+            starts[quoted] += 1
+            ends[quoted] -= 1
+        else:  # quoted values containing whitespace
+            spans = [match.span(match.lastindex) for match in _TOKEN_PATTERN.finditer(body)]
+            starts, ends = np.array(spans, dtype=np.int64).reshape(-1, 2).T
+    width = int((ends - starts).max()) if len(starts) else 0
+    return np.concatenate([buf, np.zeros(_word_width(width) + 1, dtype=np.uint8)]), starts, ends
+
+
+def _word_width(width):
+    """Width rounded up to whole 8-byte words."""
+    return max(-(-width // 8) * 8, 8)
+
+
+def _gather(buf, starts, ends):
+    """Copy tokens into a (tokens, width) byte matrix, zero past each token; returns (matrix, lengths).
+
+    Missing values ('?' and '.') get length 0."""
+    lengths = ends - starts
+    first = buf[starts]
+    missing = (lengths == 1) & ((first == ord("?")) | (first == ord(".")))
+    lengths = np.where(missing, 0, lengths)
+    width = _word_width(int(lengths.max()) if len(lengths) else 0)
+    # each row is a copy of a window of the padded buffer; the bytes past the token
+    # are cleared word by word (little-endian: the first byte is the lowest one)
+    chars = sliding_window_view(buf, width)[starts]
+    if np.little_endian:
+        kept = np.clip(lengths[:, None] - 8 * np.arange(width // 8), 0, 8).astype(np.uint64)
+        words = chars.view(np.uint64)
+        words &= np.where(kept > 0, _ALL_BYTES >> (np.uint64(8) * (np.uint64(8) - kept)), np.uint64(0))
+    else:
+        chars[np.arange(width) >= lengths[:, None]] = 0
+    return chars, lengths
+
+
+class _Columns:
+    """Access to the columns of a tokenized atom_site loop."""
+
+    def __init__(self, fields, buf, starts, ends):
+        if len(starts) % len(fields):
+            raise ValueError(f"Malformed atom_site loop: {len(starts)} values for {len(fields)} columns")
+        self.fields = {name: index for index, name in enumerate(fields)}
+        self.buf, self.starts, self.ends = buf, starts, ends
+        self.n_atoms = len(starts) // len(fields)
+
+    def chars(self, *names):
+        """(byte matrix, lengths) of the first available column (see _gather), or None."""
+        for name in names:
+            if name in self.fields:
+                index, step = self.fields[name], len(self.fields)
+                return _gather(self.buf, self.starts[index::step], self.ends[index::step])
+        return None
+
+    def raw(self, *names):
+        """Byte strings of the first available column (missing values empty), or None."""
+        column = self.chars(*names)
+        if column is None:
+            return None
+        return column[0].view(f"S{column[0].shape[1]}").ravel()
+
+    def text(self, *names):
+        """Unicode strings of the first available column (missing values empty)."""
+        column = self.chars(*names)
+        if column is None:
+            return np.full(self.n_atoms, "", dtype="U1")
+        chars, lengths = column
+        width = max(int(lengths.max()) if len(lengths) else 0, 1)
+        # widening the ASCII bytes to UCS-4 code points is a Unicode array without decoding each value
+        return chars[:, :width].astype(np.uint32).view(f"U{width}").ravel()
+
+    def number(self, dtype, *names, default=0):
+        """Numeric values of the first available column (missing values = default)."""
+        column = self.raw(*names)
+        if column is None:
+            return np.full(self.n_atoms, default, dtype=dtype)
+        column[column == b""] = str(default).encode()
+        return column.astype(dtype)
+
+
+def parse_cif(data):
+    """Parse the atom_site loop of mmCIF text (bytes) into a PDB_Parser.Structure."""
+    loop = _find_loop(data)
+    if loop is None:
+        return PDB_Parser.parse_structure(b"")
+    fields, body = loop
+    columns = _Columns(fields, *_tokenize(body))
+
+    name = columns.text("auth_atom_id", "label_atom_id")
+    symbols = columns.chars("type_symbol")
+    if symbols is None:
+        symbols = np.zeros((columns.n_atoms, 8), dtype=np.uint8), np.zeros(columns.n_atoms, dtype=np.int64)
+    letters, lengths = symbols
+    width = max(int(lengths.max()) if len(lengths) else 0, 1)
+    # PDB files write element symbols in upper case ('FE'), mmCIF files often do not ('Fe')
+    letters[(letters >= ord("a")) & (letters <= ord("z"))] -= ord("a") - ord("A")
+    element = letters[:, :width].astype(np.uint32).view(f"U{width}").ravel()
+    missing = element == ""
+    if missing.any():
+        element = element.astype("U2")
+        element[missing] = PDB_Parser._guess_elements(name[missing])
+
+    coords = np.empty((columns.n_atoms, 3), dtype=np.float32)
+    for axis, field in enumerate(("Cartn_x", "Cartn_y", "Cartn_z")):
+        coords[:, axis] = columns.number(np.float32, field)
+
+    group = columns.raw("group_PDB")
+    return PDB_Parser.Structure(
+        hetero=group == b"HETATM" if group is not None else np.zeros(columns.n_atoms, dtype=bool),
+        serial=columns.number(np.int32, "id"),
+        name=name,
+        altloc=columns.text("label_alt_id"),
+        resname=columns.text("auth_comp_id", "label_comp_id"),
+        chain=columns.text("auth_asym_id", "label_asym_id"),
+        resnum=columns.number(np.int32, "auth_seq_id", "label_seq_id"),
+        icode=columns.text("pdbx_PDB_ins_code"),
+        coords=coords,
+        occupancy=columns.number(np.float32, "occupancy"),
+        bfactor=columns.number(np.float32, "B_iso_or_equiv"),
+        element=element,
+        model=columns.number(np.int32, "pdbx_PDB_model_num", default=1),
+    )
+
+
+def iter_cif_models(structure):
+    """Split a parsed multi-model structure into one Structure per model, in file order."""
+    boundaries = np.flatnonzero(np.diff(structure.model)) + 1
+    for start, stop in zip(np.concatenate([[0], boundaries]), np.concatenate([boundaries, [len(structure)]])):
+        if stop > start:
+            yield structure.select(slice(start, stop))
@@ -12,13 +12,38 @@ This script calculates:
 Author: Niayesh Zarifi
 
 Usage:
-    python Calculate_Deviation_Diversity_Ens.py <crystal_structure.pdb> <ensemble_dir> <output_file.csv>
+    python Calculate_Deviation_Diversity_Ens.py <crystal_structure.pdb> <ensemble_dir> <output_file.csv> [options]
 
 Arguments:
     crystal_structure.pdb : The reference crystal structure PDB file.
-    ensemble_dir (str)    : Directory containing the ensemble PDB files.
+    ensemble_dir (str)    : Directory containing the ensemble PDB files, a single
+                            multi-model (NMR/MD) PDB file whose MODEL blocks are streamed,
+                            or a coordinate store created with Coord_Store.py.
     output_file.csv (str) : Name of the output CSV file (must end in .csv).
 
+Options:
+    --pairs-npy <file.npy> Stream pairwise RMSDs tile by tile into a memory-mapped condensed
+                           upper-triangle .npy file instead of the diversity CSV (for ensembles
+                           whose full RMSD matrix does not fit in memory)
+    --memory-mb <MB>       Memory budget for the RMSD tiles of --pairs-npy and --incremental (default: 1024)
+    --jobs <N>             Number of worker processes for parsing and pairwise RMSD (0 = all cores, default: 1)
+    --incremental <dir>    Keep results (deviations, pairwise RMSDs, backbone coordinates and a manifest of
+                           the files they cover) in <dir>; later runs only compute the pairs involving new
+                           files of ensemble_dir. Pairwise values stay in <dir>/pairs.f64 (see Ensemble_State.py)
+                           instead of the diversity CSV. The results are recomputed if <dir> was built for another
+                           ensemble_dir or holds files that are no longer in it.
+    --sample-pairs <K>     Estimate the mean diversity from at most K random pairs instead of all pairs
+                           (no diversity CSV); prints the estimate with a 95% confidence interval
+    --tolerance <A>        With --sample-pairs, stop once the confidence interval half-width is below A Å
+    --time-budget <S>      With --sample-pairs, stop sampling after S seconds
+    --seed <N>             Random seed for --sample-pairs (default: 0)
+    --match <mode>         Pair backbone atoms by (chain, residue number, insertion code, atom name) instead
+                           of file order (see Atom_Matching.py): strict, intersection or align (sequence
+                           alignment). The mapping is computed once per model topology; models that cannot
+                           be matched are skipped with a warning, and only atoms matched in every model are used.
+    --select <expr>        Atoms to compare, as an Atom_Selection.py expression (default: "backbone"),
+                           e.g. "backbone and chain A" or "name CA and resid 10-120"
+
 Outputs:
     - CSV file containing:
       * Backbone RMSD values of ensemble members vs. crystal structure (Deviation)
@@ -27,24 +52,139 @@ Outputs:
 
 import os
 import sys
+import PDB_Parser
 import RMSD
+import Pairwise_RMSD
+import Parallel
+import Coord_Store
+import Ensemble_State
+import Atom_Matching
+import Atom_Selection
 import csv
-import itertools
-import time
+from functools import partial
+import numpy as np
+
+def parse_backbone(structure, selection=None):
+    """Return the backbone (or selected) coordinates of one PDB file (worker entry point)."""
+    return RMSD.parse_pdb(structure, backbone_only=True, selection=selection)
+
+def load_ensemble(ensemble, jobs=1, selection=None):
+    """Parse each ensemble member once and stack the backbone coordinates into an (M, N_atoms, 3) array."""
+    coords = None
+    parsed = Parallel.imap_ordered(partial(parse_backbone, selection=selection), ensemble, jobs=jobs)
+    for index, (structure, model_coords) in enumerate(zip(ensemble, parsed)):
+        if coords is None:
+            coords = np.empty((len(ensemble), len(model_coords), 3), dtype=np.float32)
+        if len(model_coords) != coords.shape[1]:
+            print(f"Error: {structure} has {len(model_coords)} backbone atoms, expected {coords.shape[1]} "
+                  f"(use --match to pair atoms by residue).")
+            sys.exit(1)
+        coords[index] = model_coords
+    return coords
+
+def load_ensemble_models(ensemble_pdb, selection=None):
+    """Stream the MODEL blocks of a multi-model PDB file and stack their backbone coordinates into an (M, N_atoms, 3) array."""
+    coords = []
+    for model_number, model_coords in RMSD.parse_models(ensemble_pdb, backbone_only=True, selection=selection):
+        if coords and len(model_coords) != len(coords[0]):
+            print(f"Error: Model {model_number} has {len(model_coords)} backbone atoms, expected {len(coords[0])}.")
+            sys.exit(1)
+        coords.append(model_coords.astype(np.float32))
+    return np.stack(coords) if coords else np.empty((0, 0, 3), dtype=np.float32)
+
+def load_ensemble_store(store_dir, selection=None):
+    """Read the backbone coordinates of every model of a coordinate store as an (M, N_atoms, 3) array (no text parsing)."""
+    store = Coord_Store.open_store(store_dir)
+    return np.ascontiguousarray(store.coords[:, RMSD.selection_mask(store.topology, backbone_only=True, selection=selection)])
+
+def parse_backbone_structure(structure, selection=None):
+    """Return the backbone (or selected) atoms of one PDB file as a Structure (worker entry point)."""
+    return RMSD.parse_structure(structure, backbone_only=True, selection=selection)
 
-def deviation(ensemble, crystal_structure):
+def iter_ensemble_structures(ensemble_dir, jobs=1, selection=None):
+    """Yield (name, backbone Structure) for every model of a directory, multi-model PDB file or coordinate store."""
+    if os.path.isdir(ensemble_dir) and not Coord_Store.is_store(ensemble_dir):
+        ensemble = [os.path.join(ensemble_dir, f) for f in os.listdir(ensemble_dir) if PDB_Parser.is_structure_file(f)]
+        parse = partial(parse_backbone_structure, selection=selection)
+        # windowed: parsed structures are large, so workers must not run ahead of the consumer
+        yield from zip(ensemble, Parallel.imap_windowed(parse, ensemble, jobs=jobs))
+    else:
+        for model_number, structure in RMSD.parse_model_structures(ensemble_dir, backbone_only=True, selection=selection):
+            yield f"Model {model_number}", structure
+
+def load_ensemble_matched(models, crystal, mode):
+    """Match every model onto the crystal backbone by atom identity and stack the matched coordinates.
+
+    `models` yields (name, Structure). Models that cannot be matched are skipped
+    with a warning. Returns (ensemble_coords, crystal_coords, names), restricted to
+    the crystal atoms matched in every model."""
+    mapper = Atom_Matching.AtomMapper(crystal, mode)
+    names, mappings, coords = [], [], []
+    for name, structure in models:
+        try:
+            mappings.append(mapper.lookup(structure))
+        except Atom_Matching.MatchError as e:
+            print(f"Warning: {name} skipped: {e}")
+            continue
+        names.append(name)
+        coords.append(structure.coords)
+    if not names:
+        print("Error: No ensemble member could be matched onto the crystal structure.")
+        sys.exit(1)
+
+    # one mask per distinct topology, not per model
+    common = np.logical_and.reduce([m >= 0 for m in mapper.mappings.values() if not isinstance(m, Exception)])
+    if common.sum() < len(crystal):
+        print(f"Using {common.sum()} of {len(crystal)} crystal backbone atoms matched in every model.")
+    ensemble_coords = np.empty((len(names), common.sum(), 3), dtype=np.float32)
+    for index, (ref_to_model, model_coords) in enumerate(zip(mappings, coords)):
+        ensemble_coords[index] = model_coords[ref_to_model[common]]
+    return ensemble_coords, crystal.coords[common].astype(np.float64), names
+
+def deviation(ensemble_coords, crystal_coords):
     """Calculate backbone RMSD of each ensemble member against the crystal structure."""
-    RMSDs_wrt_xtal = []
-    for structure in ensemble:
-        rmsd = RMSD.main(structure, crystal_structure, backbone_only=True)
-        RMSDs_wrt_xtal.append(rmsd)
-    return RMSDs_wrt_xtal
-
-def diversity(ensemble):
-    """Calculate pairwise backbone RMSD among ensemble members."""
-    all_iterations = list(itertools.combinations(ensemble, 2))
-    pair_rmsds = [RMSD.main(pair[0], pair[1], backbone_only=True) for pair in all_iterations]
-    return pair_rmsds
+    if ensemble_coords.shape[1] != len(crystal_coords):
+        print("Error: Structures have different numbers of selected atoms.")
+        sys.exit(1)
+    return RMSD.kabsch_rmsd_batch(ensemble_coords, crystal_coords).tolist()
+
+def diversity(ensemble_coords, jobs=1):
+    """Calculate pairwise backbone RMSD among ensemble members (same order as itertools.combinations)."""
+    matrix = Pairwise_RMSD.pairwise_rmsd(ensemble_coords, jobs=jobs)
+    return matrix[np.triu_indices(len(matrix), k=1)].tolist()
+
+def diversity_to_file(ensemble_coords, output_npy, memory_mb=1024, jobs=1):
+    """Stream pairwise backbone RMSDs into a condensed .npy file; returns running summary statistics."""
+    return Pairwise_RMSD.write_condensed_rmsd(ensemble_coords, output_npy, memory_mb=memory_mb, jobs=jobs)
+
+def update_incremental(state_dir, crystal_structure, crystal_coords, ensemble, jobs=1, selection=None, memory_mb=1024,
+                       ensemble_dir=None):
+    """Add the ensemble files not yet in the saved state; returns the updated state.
+
+    The state is rebuilt if it was made for another ensemble directory or holds files no longer in `ensemble`."""
+    state = Ensemble_State.EnsembleState(state_dir)
+    selection = selection or "backbone"
+    if not state.is_current(crystal_structure, len(crystal_coords), selection, ensemble_dir, ensemble):
+        state.reset(crystal_structure, len(crystal_coords), selection, ensemble_dir)
+    new_files = state.new_files(sorted(ensemble))
+    if new_files:
+        new_coords = load_ensemble(new_files, jobs=jobs, selection=selection)
+        state.append(new_files, new_coords, deviation(new_coords, crystal_coords), memory_mb=memory_mb, jobs=jobs)
+    print(f"Added {len(new_files)} new models ({state.n_models} in total).")
+    return state
+
+def sampled_diversity(ensemble_coords, max_pairs, tolerance=None, time_budget=None, seed=0):
+    """Estimate the mean pairwise backbone RMSD from randomly sampled pairs (see Pairwise_RMSD.estimate_mean_rmsd)."""
+    return Pairwise_RMSD.estimate_mean_rmsd(ensemble_coords, max_pairs, tolerance=tolerance,
+                                            time_budget=time_budget, seed=seed)
+
+def option_value(options, flag, default=None, cast=str):
+    """Return the value following `flag` in the options, or the default."""
+    if flag in options:
+        index = options.index(flag) + 1
+        if index < len(options):
+            return cast(options[index])
+    return default
 
 def write_rmsd(results, output_file):
     """Write RMSD results to a CSV file."""
@@ -58,39 +198,109 @@ def average(lst):
     return sum(lst) / len(lst) if lst else 0.0
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: python Calculate_Deviation_Diversity_Ens.py <crystal_structure.pdb> <ensemble_dir> <output_file.csv>")
+    if len(sys.argv) < 4:
+        print("Usage: python Calculate_Deviation_Diversity_Ens.py <crystal_structure.pdb> <ensemble_dir> <output_file.csv> [options]")
         sys.exit(1)
     
     crystal_structure = sys.argv[1]
     ensemble_dir = sys.argv[2]
     output_file = sys.argv[3]
+    options = sys.argv[4:]
+    
+    pairs_npy = option_value(options, "--pairs-npy")
+    memory_mb = option_value(options, "--memory-mb", 1024, float)
+    jobs = Parallel.jobs_from_options(options)
+    state_dir = option_value(options, "--incremental")
+    sample_pairs = option_value(options, "--sample-pairs", cast=int)
+    tolerance = option_value(options, "--tolerance", cast=float)
+    time_budget = option_value(options, "--time-budget", cast=float)
+    seed = option_value(options, "--seed", default=0, cast=int)
+    match = option_value(options, "--match")
+    selection = option_value(options, "--select")
+    if selection is not None:
+        try:
+            Atom_Selection.compile_selection(selection)
+        except Atom_Selection.SelectionError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    if "--match" in options and match not in Atom_Matching.MATCH_MODES:
+        print(f"Error: --match expects one of: {', '.join(Atom_Matching.MATCH_MODES)}")
+        sys.exit(1)
     
     if not output_file.endswith(".csv"):
         print("Error: Output file must have a .csv extension.")
         sys.exit(1)
     
-    # Collect ensemble PDB files
-    ensemble = [os.path.join(ensemble_dir, f) for f in os.listdir(ensemble_dir) if f.endswith(".pdb")]
+    # Parse every structure exactly once
+    crystal_backbone = RMSD.parse_structure(crystal_structure, backbone_only=True, selection=selection)
+    crystal_coords = crystal_backbone.coords.astype(np.float64)
     
-    if not ensemble:
-        print("Error: No PDB files found in the ensemble directory.")
+    if state_dir and match:
+        print("Error: --match cannot be combined with --incremental.")
         sys.exit(1)
     
-    # Compute deviation and diversity
-    RMSDs_wrt_xtal = deviation(ensemble, crystal_structure)
-    pair_rmsds = diversity(ensemble)
+    if state_dir:
+        if not os.path.isdir(ensemble_dir):
+            print("Error: --incremental requires a directory of ensemble PDB files.")
+            sys.exit(1)
+        ensemble = [os.path.join(ensemble_dir, f) for f in os.listdir(ensemble_dir) if PDB_Parser.is_structure_file(f)]
+        state = update_incremental(state_dir, crystal_structure, crystal_coords, ensemble, jobs=jobs, selection=selection,
+                                   memory_mb=memory_mb, ensemble_dir=ensemble_dir)
+        write_rmsd(state.deviations().tolist(), f"deviation_{output_file}")
+        print(f"Mean Backbone Deviation: {state.mean_deviation:.3f} Å")
+        print(f"Mean Backbone Diversity: {state.mean_diversity:.3f} Å")
+        with open(output_file, 'w', newline='') as myfile:
+            myfile.write("Deviation,Diversity\n")
+            myfile.write(f"{state.mean_deviation},{state.mean_diversity}\n")
+        sys.exit(0)
     
-    # Write results
-    write_rmsd(RMSDs_wrt_xtal, f"deviation_{output_file}")
-    write_rmsd(pair_rmsds, f"diversity_{output_file}")
+    if match:
+        ensemble_coords, crystal_coords, _ = load_ensemble_matched(
+            iter_ensemble_structures(ensemble_dir, jobs=jobs, selection=selection), crystal_backbone, match)
+    elif Coord_Store.is_store(ensemble_dir):
+        ensemble_coords = load_ensemble_store(ensemble_dir, selection=selection)
+    elif os.path.isfile(ensemble_dir):
+        # Multi-model PDB file: read the MODEL blocks directly, no splitting needed
+        ensemble_coords = load_ensemble_models(ensemble_dir, selection=selection)
+        if not len(ensemble_coords):
+            print("Error: No models found in the ensemble PDB file.")
+            sys.exit(1)
+    else:
+        # Collect ensemble PDB files
+        ensemble = [os.path.join(ensemble_dir, f) for f in os.listdir(ensemble_dir) if PDB_Parser.is_structure_file(f)]
+        
+        if not ensemble:
+            print("Error: No PDB files found in the ensemble directory.")
+            sys.exit(1)
+        
+        ensemble_coords = load_ensemble(ensemble, jobs=jobs, selection=selection)
     
-    # Compute mean values
+    # Compute deviation and diversity from the in-memory coordinates
+    RMSDs_wrt_xtal = deviation(ensemble_coords, crystal_coords)
+    write_rmsd(RMSDs_wrt_xtal, f"deviation_{output_file}")
     mean_deviation = average(RMSDs_wrt_xtal)
-    mean_diversity = average(pair_rmsds)
+    
+    if sample_pairs:
+        estimate = sampled_diversity(ensemble_coords, sample_pairs, tolerance=tolerance,
+                                     time_budget=time_budget, seed=seed)
+        mean_diversity = estimate.mean
+    elif pairs_npy:
+        summary = diversity_to_file(ensemble_coords, pairs_npy, memory_mb=memory_mb, jobs=jobs)
+        mean_diversity = summary.mean
+    else:
+        pair_rmsds = diversity(ensemble_coords, jobs=jobs)
+        write_rmsd(pair_rmsds, f"diversity_{output_file}")
+        mean_diversity = average(pair_rmsds)
     
     print(f"Mean Backbone Deviation: {mean_deviation:.3f} Å")
-    print(f"Mean Backbone Diversity: {mean_diversity:.3f} Å")
+    if sample_pairs:
+        print(f"Mean Backbone Diversity: {mean_diversity:.3f} ± {estimate.half_width:.3f} Å "
+              f"({estimate.confidence:.0%} CI, {estimate.count} pairs)")
+    else:
+        print(f"Mean Backbone Diversity: {mean_diversity:.3f} Å")
+    if pairs_npy and not sample_pairs:
+        print(f"Diversity percentiles (5/50/95): {summary.percentile(5):.2f} / {summary.percentile(50):.2f} / {summary.percentile(95):.2f} Å")
+        print(f"Pairwise RMSDs saved to {pairs_npy}")
     
     # Save summary results
     with open(output_file, 'w', newline='') as myfile:
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+"""
+Binary Coordinate Store
+=======================
+Packs an ensemble (a directory of PDB files such as the output of
+Split_PDBs_Ensemble or an AlphaFold run, or one multi-model PDB file) into a
+compact binary store, and exports it back to PDB files.
+
+A store is a directory containing:
+
+    meta.json      : number of models and atoms, per-model fields, format version
+    topology.npy   : parsed columns of the first model (names, residues, chains, ...)
+    names.txt      : one model name per line
+    coords.f32     : float32 coordinate block of shape (models, atoms, 3)
+    bfactor.f32    : float32 B-factors of shape (models, atoms), if they vary between models
+    occupancy.f32  : float32 occupancies of shape (models, atoms), if they vary between models
+
+The blocks are opened with `np.memmap`, so loading a store is instant and only
+the frames that are actually used are read from disk. All models must share
+the topology of the first one (same atom names, residue names, chains, residue
+numbers and insertion codes, in the same order). B-factors (e.g. AlphaFold
+pLDDTs) and occupancies are kept per model when they differ from the first
+model's, otherwise they are taken from the topology.
+
+A store is written to a temporary directory next to <store_dir> and moved into
+place when complete, so an interrupted pack never leaves a partial store.
+
+RMSD.py (--models), Calculate_Deviation_Diversity_Ens.py and
+Pi_Stacking_Analysis.py accept a store path wherever they accept a
+multi-model PDB file.
+
+Usage:
+------
+    python Coord_Store.py pack <input_dir | ensemble.pdb> <store_dir> [--jobs N]
+    python Coord_Store.py unpack <store_dir> <output_dir>
+
+Example:
+--------
+    python Coord_Store.py pack af_models/ af_models.store --jobs 16
+    python Calculate_Deviation_Diversity_Ens.py xtal.pdb af_models.store results.csv
+"""
+
+import json
+import os
+import shutil
+import sys
+import numpy as np
+import Parallel
+import PDB_Parser
+
+
+FORMAT_VERSION = 2
+# columns that may vary between the models of a store, besides the coordinates
+PER_MODEL_FIELDS = ("bfactor", "occupancy")
+# columns that must be identical in every model
+TOPOLOGY_FIELDS = ("name", "resname", "chain", "resnum", "icode")
+
+
+class CoordStore:
+    """An opened coordinate store: shared topology plus memory-mapped (models, atoms, 3) coordinates."""
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, "meta.json"), 'r') as meta_file:
+            meta = json.load(meta_file)
+        self.topology = PDB_Parser.Structure.from_records(np.load(os.path.join(store_dir, "topology.npy")))
+        with open(os.path.join(store_dir, "names.txt"), 'r') as names_file:
+            self.names = [line.rstrip("\n") for line in names_file]
+        shape = (meta["n_models"], meta["n_atoms"], 3)
+        if shape[0]:
+            self.coords = np.memmap(os.path.join(store_dir, "coords.f32"), dtype=np.float32, mode='r', shape=shape)
+        else:
+            self.coords = np.empty(shape, dtype=np.float32)
+        # per-model columns (version 1 stores have none); None means "same as the topology"
+        self.per_model = {field: np.memmap(os.path.join(store_dir, f"{field}.f32"), dtype=np.float32,
+                                           mode='r', shape=shape[:2])
+                          for field in meta.get("per_model_fields", [])}
+
+    def __len__(self):
+        return len(self.coords)
+
+    def model(self, index):
+        """Return model `index` as a full Structure (topology with that model's coordinates)."""
+        structure = self.topology.select(slice(None))
+        structure.coords = np.asarray(self.coords[index])
+        for field, values in self.per_model.items():
+            setattr(structure, field, np.asarray(values[index]))
+        return structure
+
+
+def is_store(path):
+    """True if the path is a coordinate store directory."""
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, "meta.json"))
+
+
+def open_store(store_dir):
+    """Open a coordinate store for reading."""
+    return CoordStore(store_dir)
+
+
+def iter_sources(source, jobs=1):
+    """Yield (name, Structure) for every model of a directory of PDB files or a multi-model PDB file."""
+    if os.path.isdir(source):
+        pdb_files = sorted(f for f in os.listdir(source) if PDB_Parser.is_structure_file(f))
+        paths = [os.path.join(source, f) for f in pdb_files]
+        # windowed: parsed structures are large, so workers must not run ahead of the writer
+        for pdb_file, structure in zip(pdb_files, Parallel.imap_windowed(PDB_Parser.read_structure, paths, jobs=jobs)):
+            yield PDB_Parser.structure_stem(pdb_file), structure
+    else:
+        prefix = PDB_Parser.structure_stem(source)
+        for structure in PDB_Parser.iter_models(source):
+            yield f"{prefix}_{structure.model[0]}", structure
+
+
+def same_topology(structure, topology):
+    """True if a model has the same atoms as the topology, in the same order (see TOPOLOGY_FIELDS)."""
+    return len(structure) == len(topology) and all(
+        np.array_equal(getattr(structure, field), getattr(topology, field)) for field in TOPOLOGY_FIELDS)
+
+
+def pack(source, store_dir, jobs=1):
+    """Pack every model of `source` into a coordinate store; returns the number of models written.
+
+    An existing store at `store_dir` is replaced; any other existing path is left alone (ValueError)."""
+    if os.path.exists(store_dir) and not is_store(store_dir):
+        if not os.path.isdir(store_dir) or os.listdir(store_dir):
+            raise ValueError(f"{store_dir} exists and is not a coordinate store")
+    temporary = f"{os.path.normpath(store_dir)}.{os.getpid()}.tmp"
+    os.makedirs(temporary)
+    try:
+        n_models = _write_store(source, temporary, jobs)
+        _replace_dir(temporary, store_dir)
+    except BaseException:
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+    return n_models
+
+
+def _write_store(source, store_dir, jobs):
+    """Write the store files of every model of `source` into an empty directory."""
+    topology = None
+    names = []
+    varying = dict.fromkeys(PER_MODEL_FIELDS, False)
+    blocks = {"coords": "coords.f32", **{field: f"{field}.f32" for field in PER_MODEL_FIELDS}}
+    files = {block: open(os.path.join(store_dir, filename), 'wb') for block, filename in blocks.items()}
+    try:
+        for name, structure in iter_sources(source, jobs):
+            if topology is None:
+                topology = structure
+                np.save(os.path.join(store_dir, "topology.npy"), topology.to_records(), allow_pickle=False)
+            elif not same_topology(structure, topology):
+                raise ValueError(f"{name} does not match the topology of the first model")
+            for block, output_file in files.items():
+                output_file.write(np.ascontiguousarray(getattr(structure, block), dtype=np.float32).tobytes())
+            for field in PER_MODEL_FIELDS:
+                varying[field] = varying[field] or not np.array_equal(getattr(structure, field), getattr(topology, field))
+            names.append(name)
+    finally:
+        for output_file in files.values():
+            output_file.close()
+
+    if topology is None:
+        raise ValueError(f"No models found in {source}")
+    # columns identical in every model are read from the topology instead
+    per_model_fields = [field for field in PER_MODEL_FIELDS if varying[field]]
+    for field in PER_MODEL_FIELDS:
+        if not varying[field]:
+            os.remove(os.path.join(store_dir, blocks[field]))
+    with open(os.path.join(store_dir, "names.txt"), 'w') as names_file:
+        names_file.writelines(f"{name}\n" for name in names)
+    with open(os.path.join(store_dir, "meta.json"), 'w') as meta_file:
+        json.dump({"version": FORMAT_VERSION, "n_models": len(names), "n_atoms": len(topology),
+                   "per_model_fields": per_model_fields}, meta_file)
+    return len(names)
+
+
+def _replace_dir(source_dir, target_dir):
+    """Move a complete directory into place, replacing `target_dir` (empty or a previous store)."""
+    if os.path.isdir(target_dir) and os.listdir(target_dir):
+        # a non-empty directory cannot be replaced in one rename: move the old store aside first
+        previous = f"{source_dir}.old"
+        os.replace(target_dir, previous)
+        os.replace(source_dir, target_dir)
+        shutil.rmtree(previous, ignore_errors=True)
+    else:
+        os.replace(source_dir, target_dir)
+
+
+def unpack(store_dir, output_dir):
+    """Write every model of a coordinate store back to its own PDB file; returns the list of files."""
+    store = open_store(store_dir)
+    # stores packed from mmCIF files may have chain IDs longer than one character
+    chain_map = PDB_Parser.pdb_chain_map(store.topology)
+    for long_chain, chain in chain_map.items():
+        print(f"Note: chain {long_chain} is written as chain {chain}")
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    for index, name in enumerate(store.names):
+        output_filename = os.path.join(output_dir, f"{name}.pdb")
+        with open(output_filename, 'w') as output_file:
+            output_file.writelines(PDB_Parser.format_atom_lines(PDB_Parser.remap_chains(store.model(index), chain_map)))
+            output_file.write("END\n")
+        written.append(output_filename)
+    return written
+
+
+def main():
+    """Command-line entry point for packing and unpacking stores."""
+    arguments = Parallel.strip_jobs_option(sys.argv)
+    if len(arguments) != 4 or arguments[1] not in ("pack", "unpack"):
+        print("Usage: python Coord_Store.py pack <input_dir | ensemble.pdb> <store_dir> [--jobs N]")
+        print("       python Coord_Store.py unpack <store_dir> <output_dir>")
+        sys.exit(1)
+
+    if arguments[1] == "pack":
+        try:
+            n_models = pack(arguments[2], arguments[3], Parallel.jobs_from_options(sys.argv))
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Packed {n_models} models into {arguments[3]}")
+    else:
+        written = unpack(arguments[2], arguments[3])
+        print(f"Wrote {len(written)} PDB files to {arguments[3]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+"""
+Incremental Ensemble State
+==========================
+Persistent results for Calculate_Deviation_Diversity_Ens.py --incremental, so
+that adding models to an ensemble only costs the new-vs-reference and
+new-vs-all RMSDs instead of recomputing everything.
+
+A state is a directory containing:
+
+    manifest.json  : reference file identity, atom selection, ensemble directory, ensemble
+                     files (path, mtime, size) in insertion order, number of atoms and
+                     running sums
+    coords.f32     : float32 coordinates of the selected atoms, shape (models, atoms, 3)
+    deviation.f64  : float64 RMSD of each model vs. the reference, shape (models,)
+    pairs.f64      : float64 pairwise RMSDs as a lower triangle, row by row:
+                     row i holds rmsd(i, 0), ..., rmsd(i, i - 1)
+
+Every file is append-only: new models add rows at the end, so an update writes
+O(new models x ensemble size) values. The new pairs are computed in tiles
+sized to a memory budget (see Pairwise_RMSD) and written straight into their
+rows, so an update never holds a new-vs-all block in memory. If the reference
+or any recorded file changed or disappeared, the atom selection or ensemble
+directory differs, or a recorded file is no longer part of the ensemble, the
+state is discarded and rebuilt from scratch.
+"""
+
+import json
+import os
+import numpy as np
+import Pairwise_RMSD
+
+_STATE_FILES = ("manifest.json", "coords.f32", "deviation.f64", "pairs.f64")
+
+
+def _abspath(path):
+    """Absolute path, or None."""
+    return os.path.abspath(path) if path is not None else None
+
+
+def file_identity(path):
+    """(absolute path, mtime, size) used to detect changed files."""
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_mtime_ns, stat.st_size]
+
+
+class EnsembleState:
+    """Deviation vector, pairwise RMSDs and backbone coordinates of the models seen so far."""
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        manifest_path = os.path.join(state_dir, "manifest.json")
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, 'r') as manifest_file:
+                self.manifest = json.load(manifest_file)
+        else:
+            self.manifest = None
+
+    def path(self, name):
+        return os.path.join(self.state_dir, name)
+
+    @property
+    def n_models(self):
+        return len(self.manifest["files"]) if self.manifest else 0
+
+    def is_current(self, reference, n_atoms, selection="backbone", ensemble_dir=None, ensemble=()):
+        """True if the state was built against this reference, selection and ensemble directory,
+        all of its files are still in `ensemble` and none of them changed."""
+        if not self.manifest:
+            return False
+        if self.manifest["reference"] != file_identity(reference) or self.manifest["n_atoms"] != n_atoms:
+            return False
+        if self.manifest.get("selection", "backbone") != selection:
+            return False
+        if self.manifest.get("ensemble_dir") != _abspath(ensemble_dir):
+            return False
+        current = {os.path.abspath(path) for path in ensemble}
+        if not all(identity[0] in current for identity in self.manifest["files"]):
+            return False
+        for identity in self.manifest["files"]:
+            if not os.path.isfile(identity[0]) or file_identity(identity[0]) != identity:
+                return False
+        return self.repair()
+
+    def repair(self):
+        """Truncate data files left longer than the manifest by an interrupted update; False if any is too short."""
+        n = self.n_models
+        expected = {"coords.f32": n * self.manifest["n_atoms"] * 3 * 4,
+                    "deviation.f64": n * 8,
+                    "pairs.f64": n * (n - 1) // 2 * 8}
+        for name, size in expected.items():
+            actual = os.path.getsize(self.path(name)) if os.path.exists(self.path(name)) else 0
+            if actual < size:
+                return False
+            if actual > size:
+                os.truncate(self.path(name), size)
+        return True
+
+    def reset(self, reference, n_atoms, selection="backbone", ensemble_dir=None):
+        """Discard all stored results and start an empty state for this reference, selection and ensemble directory."""
+        for name in _STATE_FILES:
+            if os.path.exists(self.path(name)):
+                os.remove(self.path(name))
+        self.manifest = {"reference": file_identity(reference), "selection": selection,
+                         "ensemble_dir": _abspath(ensemble_dir), "n_atoms": n_atoms, "files": [],
+                         "deviation_sum": 0.0, "pair_sum": 0.0, "pair_count": 0}
+
+    def new_files(self, files):
+        """Files not yet part of the state, in the given order."""
+        known = {identity[0] for identity in self.manifest["files"]}
+        return [path for path in files if os.path.abspath(path) not in known]
+
+    def coords(self):
+        """Memory-mapped (models, atoms, 3) backbone coordinates of the stored models."""
+        shape = (self.n_models, self.manifest["n_atoms"], 3)
+        if not self.n_models:
+            return np.empty(shape, dtype=np.float32)
+        return np.memmap(self.path("coords.f32"), dtype=np.float32, mode='r', shape=shape)
+
+    def deviations(self):
+        """RMSD of every stored model against the reference."""
+        if not self.n_models:
+            return np.empty(0)
+        return np.fromfile(self.path("deviation.f64"), dtype=np.float64)
+
+    def append(self, files, coords, deviations, memory_mb=1024, jobs=1):
+        """Add new models: store their coordinates and deviations and compute only the pairs that involve them.
+
+        The pairs are computed in tiles across `jobs` processes, within a total of `memory_mb`."""
+        n_old = self.n_models
+        n_total = n_old + len(coords)
+        with open(self.path("coords.f32"), 'ab') as coords_file:
+            coords_file.write(np.ascontiguousarray(coords, dtype=np.float32).tobytes())
+        with open(self.path("deviation.f64"), 'ab') as deviation_file:
+            deviation_file.write(np.asarray(deviations, dtype=np.float64).tobytes())
+
+        # the new rows of the lower triangle are the upper-triangle columns n_old and beyond
+        first_pair = n_old * (n_old - 1) // 2
+        n_pairs = n_total * (n_total - 1) // 2 - first_pair
+        if n_pairs:
+            with open(self.path("pairs.f64"), 'ab') as pairs_file:
+                pairs_file.truncate((first_pair + n_pairs) * 8)
+            pairs = np.memmap(self.path("pairs.f64"), dtype=np.float64, mode='r+', offset=first_pair * 8,
+                              shape=(n_pairs,))
+            all_coords = np.memmap(self.path("coords.f32"), dtype=np.float32, mode='r',
+                                   shape=(n_total, self.manifest["n_atoms"], 3))
+            size = Pairwise_RMSD.tile_size(self.manifest["n_atoms"], memory_mb / max(jobs, 1))
+            tiles = Pairwise_RMSD.iter_computed_tiles(all_coords, size, jobs, first_col=n_old)
+            for (row_start, row_stop, col_start, _), tile in tiles:
+                # column j of the tile is part of row j of the lower triangle: rmsd(j, i) for i < j
+                for offset, column in enumerate(tile.T):
+                    j = col_start + offset
+                    segment = column[:min(row_stop, j) - row_start]
+                    if not len(segment):
+                        continue
+                    start = j * (j - 1) // 2 + row_start - first_pair
+                    pairs[start:start + len(segment)] = segment
+                    self.manifest["pair_sum"] += float(segment.sum())
+                    self.manifest["pair_count"] += len(segment)
+            pairs.flush()
+            del pairs, all_coords
+
+        self.manifest["deviation_sum"] += float(np.sum(deviations))
+        self.manifest["files"].extend(file_identity(path) for path in files)
+        self.save()
+
+    def save(self):
+        """Write the manifest after the data files; data appended by an interrupted update is truncated by repair()."""
+        temporary = self.path("manifest.json.tmp")
+        with open(temporary, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file)
+        os.replace(temporary, self.path("manifest.json"))
+
+    @property
+    def mean_deviation(self):
+        return self.manifest["deviation_sum"] / self.n_models if self.n_models else 0.0
+
+    @property
+    def mean_diversity(self):
+        count = self.manifest["pair_count"]
+        return self.manifest["pair_sum"] / count if count else 0.0
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+
+"""
+Columnar PDB Parser
+===================
+Shared reader used by every script in this toolkit. A PDB file is read once,
+the ATOM/HETATM records are pulled out in bulk and the fixed-width columns are
+sliced as NumPy arrays instead of being parsed line by line in Python.
+
+The parsed structure exposes one array per PDB column:
+
+    hetero     (bool)      : True for HETATM records, False for ATOM records
+    serial     (int32)     : Atom serial number (columns 7-11)
+    name       (str)       : Atom name (columns 13-16, stripped)
+    altloc     (str)       : Alternate location indicator (column 17)
+    resname    (str)       : Residue name (columns 18-20, stripped)
+    chain      (str)       : Chain identifier (column 22)
+    resnum     (int32)     : Residue sequence number (columns 23-26)
+    icode      (str)       : Insertion code (column 27)
+    coords     (float32)   : Nx3 array of x, y, z coordinates (columns 31-54)
+    occupancy  (float32)   : Occupancy (columns 55-60, 0.0 when blank)
+    bfactor    (float32)   : Temperature factor / pLDDT (columns 61-66, 0.0 when blank)
+    element    (str)       : Element symbol (columns 77-78, guessed from the atom name when blank)
+    model      (int32)     : MODEL number the atom belongs to (1 when the file has no MODEL records)
+
+Usage:
+------
+    import PDB_Parser
+    structure = PDB_Parser.read_structure("model.pdb")
+    ca = structure.select(structure.name == "CA")
+    print(len(ca), ca.bfactor.mean())
+
+    # multi-model (NMR/MD) files are streamed one MODEL block at a time
+    for model in PDB_Parser.iter_models("trajectory.pdb"):
+        print(model.model[0], len(model))
+
+Compressed files (.gz, .bz2, .xz) are read and written transparently by every
+function taking a filename, e.g. read_structure("1abc.pdb.gz") or
+open_pdb("clean.pdb.gz", "w"); the compression is chosen from the suffix.
+
+mmCIF files (.cif, .mmcif, optionally compressed) are read by read_structure,
+iter_models and read_atom_lines through CIF_Parser into the same columns.
+
+Structures beyond the fixed PDB columns are still written in PDB format:
+residue numbers above 9999 use the hybrid-36 encoding of other PDB tools
+(A000 = 10000, read back by the parser), and chain IDs longer than one
+character are replaced by unused single characters (see pdb_chain_map).
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import re
+import string
+from dataclasses import dataclass, fields
+import numpy as np
+import Structure_Cache
+
+
+BACKBONE_ATOMS = ("N", "CA", "C", "O")
+
+# ATOM/HETATM records plus MODEL records (needed to assign model numbers)
+_RECORD_PATTERN = re.compile(rb"^(?:ATOM  |HETATM|MODEL )[^\r\n]*", re.M)
+_ENDMDL_PATTERN = re.compile(rb"^ENDMDL[^\n]*\n?", re.M)
+_LINE_WIDTH = 80
+_CHUNK_SIZE = 16 * 1024 ** 2
+
+# coordinate file suffixes recognized in directory scans, optionally followed by a compression suffix
+CIF_SUFFIXES = (".cif", ".mmcif")
+STRUCTURE_SUFFIXES = (".pdb", ".ent") + CIF_SUFFIXES
+# residue numbers that fit the fixed PDB columns; above 9999 they are written in hybrid-36
+PDB_MAX_DECIMAL_RESNUM = 9999
+PDB_MAX_RESNUM = PDB_MAX_DECIMAL_RESNUM + 2 * 26 * 36 ** 3
+PDB_MIN_RESNUM = -999
+# single-character chain IDs given to chains whose mmCIF IDs are longer
+PDB_CHAIN_IDS = string.ascii_uppercase + string.ascii_lowercase + string.digits
+_HY36_DIGITS = (string.digits + string.ascii_uppercase, string.digits + string.ascii_lowercase)
+COMPRESSION_SUFFIXES = {".gz": gzip, ".bz2": bz2, ".xz": lzma}
+# buffer between the decompressor and the text/line readers
+IO_BUFFER_SIZE = 1024 * 1024
+
+
+@dataclass
+class Structure:
+    """Column arrays for every ATOM/HETATM record of a PDB file."""
+    hetero: np.ndarray
+    serial: np.ndarray
+    name: np.ndarray
+    altloc: np.ndarray
+    resname: np.ndarray
+    chain: np.ndarray
+    resnum: np.ndarray
+    icode: np.ndarray
+    coords: np.ndarray
+    occupancy: np.ndarray
+    bfactor: np.ndarray
+    element: np.ndarray
+    model: np.ndarray
+
+    def __len__(self):
+        return len(self.serial)
+
+    def select(self, mask):
+        """Return a new Structure restricted to the atoms selected by a boolean mask or index array."""
+        return Structure(**{field.name: getattr(self, field.name)[mask] for field in fields(self)})
+
+    def to_records(self):
+        """Pack all columns into one structured array (used by the on-disk cache)."""
+        columns = {field.name: getattr(self, field.name) for field in fields(self)}
+        dtype = np.dtype([(name, column.dtype, column.shape[1:]) for name, column in columns.items()])
+        records = np.empty(len(self), dtype=dtype)
+        for name, column in columns.items():
+            records[name] = column
+        return records
+
+    @classmethod
+    def from_records(cls, records):
+        """Rebuild a Structure from a structured array written by to_records()."""
+        return cls(**{field.name: records[field.name] for field in fields(cls)})
+
+
+def compression_module(filename):
+    """Return the gzip, bz2 or lzma module matching the filename suffix, or None for plain files."""
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(filename)[1].lower())
+
+
+def is_structure_file(filename):
+    """True if the filename ends in a coordinate file suffix (e.g. .pdb, .ent.gz, .pdb.xz)."""
+    name = filename.lower()
+    if compression_module(name) is not None:
+        name = os.path.splitext(name)[0]
+    return name.endswith(STRUCTURE_SUFFIXES)
+
+
+def is_cif_file(filename):
+    """True if the filename ends in an mmCIF suffix (e.g. .cif, .cif.gz)."""
+    name = filename.lower()
+    if compression_module(name) is not None:
+        name = os.path.splitext(name)[0]
+    return name.endswith(CIF_SUFFIXES)
+
+
+def structure_stem(filename):
+    """File name without directory, compression and coordinate suffixes ('dir/1abc.pdb.gz' -> '1abc')."""
+    name = os.path.basename(filename)
+    if compression_module(name) is not None:
+        name = os.path.splitext(name)[0]
+    return os.path.splitext(name)[0]
+
+
+def with_compression(filename, compression=None):
+    """Replace the compression suffix of a filename ('gz', 'bz2', 'xz', or None for plain text)."""
+    if compression_module(filename) is not None:
+        filename = os.path.splitext(filename)[0]
+    if compression:
+        suffix = "." + compression.lstrip(".")
+        if suffix not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown compression '{compression}' (expected one of "
+                             f"{', '.join(suffix[1:] for suffix in COMPRESSION_SUFFIXES)})")
+        filename += suffix
+    return filename
+
+
+def open_pdb(filename, mode='r'):
+    """Open a PDB file for reading or writing, text ('r', 'w', 'a') or binary ('rb', 'wb', 'ab').
+
+    Files ending in .gz, .bz2 or .xz are decompressed or compressed on the fly,
+    through a large buffer so that line-by-line readers and writers do not make
+    one call into the decompressor per line."""
+    module = compression_module(filename)
+    binary = "b" in mode
+    if module is None:
+        return open(filename, mode, buffering=IO_BUFFER_SIZE)
+    stream = module.open(filename, mode.replace("b", "") + "b")
+    if "r" in mode:
+        stream = io.BufferedReader(stream, buffer_size=IO_BUFFER_SIZE)
+    else:
+        stream = io.BufferedWriter(stream, buffer_size=IO_BUFFER_SIZE)
+    return stream if binary else io.TextIOWrapper(stream)
+
+
+def read_bytes(filename):
+    """Read the raw (decompressed) contents of a PDB file."""
+    module = compression_module(filename)
+    with (open(filename, 'rb') if module is None else module.open(filename, 'rb')) as file:
+        return file.read()
+
+
+def read_atom_lines(filename):
+    """Return the ATOM/HETATM records of a PDB file as text lines (newline terminated).
+
+    mmCIF files are converted to PDB records (see format_atom_lines), with long
+    chain IDs remapped (see pdb_chain_map)."""
+    if is_cif_file(filename):
+        structure = parse_file(filename)
+        return format_atom_lines(remap_chains(structure, pdb_chain_map(structure)))
+    data = read_bytes(filename)
+    return [line.decode() + "\n" for line in _RECORD_PATTERN.findall(data) if not line.startswith(b"MODEL")]
+
+
+def _text_column(buf, start, stop):
+    """Slice a fixed-width text column and return it as stripped strings."""
+    column = np.ascontiguousarray(buf[:, start:stop]).view(f"S{stop - start}").ravel()
+    return np.char.strip(column).astype(f"U{stop - start}")
+
+
+def _float_column(buf, start, stop):
+    """Slice a fixed-width numeric column; blank fields become 0.0."""
+    column = np.char.strip(np.ascontiguousarray(buf[:, start:stop]).view(f"S{stop - start}").ravel())
+    column[column == b""] = b"0"
+    return column.astype(np.float32)
+
+
+def _int_column(buf, start, stop):
+    """Slice a fixed-width integer column; blank fields become 0."""
+    column = np.char.strip(np.ascontiguousarray(buf[:, start:stop]).view(f"S{stop - start}").ravel())
+    column[column == b""] = b"0"
+    return column.astype(np.int32)
+
+
+def _resnum_column(buf):
+    """Slice the residue number column, decoding hybrid-36 values (above 9999) if there are any."""
+    try:
+        return _int_column(buf, 22, 26)
+    except ValueError:
+        column = np.ascontiguousarray(buf[:, 22:26]).view("S4").ravel()
+        return np.array([parse_resnum(value.decode()) if value.strip() else 0 for value in column], dtype=np.int32)
+
+
+def format_resnum(resnum):
+    """Four-character residue number field; numbers above 9999 are written in hybrid-36 (A000 = 10000)."""
+    if PDB_MIN_RESNUM <= resnum <= PDB_MAX_DECIMAL_RESNUM:
+        return f"{resnum:4d}"
+    if not PDB_MIN_RESNUM <= resnum <= PDB_MAX_RESNUM:
+        raise ValueError(f"Residue number {resnum} cannot be written in PDB format")
+    # A000-ZZZZ then a000-zzzz, each a block of 26 * 36^3 numbers
+    block, value = divmod(resnum - PDB_MAX_DECIMAL_RESNUM - 1, 26 * 36 ** 3)
+    value += 10 * 36 ** 3
+    digits = ""
+    for _ in range(4):
+        value, digit = divmod(value, 36)
+        digits = _HY36_DIGITS[block][digit] + digits
+    return digits
+
+
+def parse_resnum(field):
+    """Residue number of a four-character field, decimal or hybrid-36; ValueError if blank or malformed."""
+    field = field.strip()
+    try:
+        return int(field)
+    except ValueError:
+        pass
+    for block, digits in enumerate(_HY36_DIGITS):
+        if len(field) == 4 and field[0].isalpha() and all(character in digits for character in field):
+            return int(field, 36) - 10 * 36 ** 3 + block * 26 * 36 ** 3 + PDB_MAX_DECIMAL_RESNUM + 1
+    raise ValueError(f"Invalid residue number '{field}'")
+
+
+def _guess_elements(names):
+    """Guess element symbols from atom names (first non-digit character)."""
+    return np.char.lstrip(names, "0123456789").astype("U1")
+
+
+def _model_number(line, default):
+    """Return the serial number of a MODEL record, or the default if it is missing."""
+    tokens = line.split()
+    return int(tokens[1]) if len(tokens) > 1 and tokens[1].isdigit() else default
+
+
+def parse_structure(data):
+    """Parse the ATOM/HETATM records of PDB text (bytes) into a Structure."""
+    records = _RECORD_PATTERN.findall(data)
+    is_model = np.fromiter((line.startswith(b"MODEL") for line in records), dtype=bool, count=len(records))
+
+    # assign each atom the number of the MODEL record preceding it
+    model_numbers = np.ones(len(records), dtype=np.int32)
+    if is_model.any():
+        model_lines = (line for line in records if line.startswith(b"MODEL"))
+        model_ids = np.array([_model_number(line, default) for default, line in enumerate(model_lines, 1)], dtype=np.int32)
+        model_index = np.cumsum(is_model) - 1
+        model_numbers = np.where(model_index >= 0, model_ids[np.maximum(model_index, 0)], 1)
+        records = [line for line, flag in zip(records, is_model) if not flag]
+        model_numbers = model_numbers[~is_model]
+
+    if not records:
+        buf = np.zeros((0, _LINE_WIDTH), dtype=np.uint8)
+    else:
+        buf = np.array(records, dtype=f"S{_LINE_WIDTH}").view(np.uint8).reshape(-1, _LINE_WIDTH)
+
+    name = _text_column(buf, 12, 16)
+    element = _text_column(buf, 76, 78)
+    missing = element == ""
+    if missing.any():
+        element[missing] = _guess_elements(name[missing])
+
+    try:
+        serial = _int_column(buf, 6, 11)
+    except ValueError:  # hybrid-36 or overflowed serial numbers
+        serial = np.arange(1, len(buf) + 1, dtype=np.int32)
+
+    coords = np.ascontiguousarray(buf[:, 30:54]).view("S8").reshape(-1, 3).astype(np.float32)
+
+    return Structure(
+        hetero=buf[:, 0] == ord("H"),
+        serial=serial,
+        name=name,
+        altloc=_text_column(buf, 16, 17),
+        resname=_text_column(buf, 17, 20),
+        chain=_text_column(buf, 21, 22),
+        resnum=_resnum_column(buf),
+        icode=_text_column(buf, 26, 27),
+        coords=coords,
+        occupancy=_float_column(buf, 54, 60),
+        bfactor=_float_column(buf, 60, 66),
+        element=element,
+        model=model_numbers.astype(np.int32),
+    )
+
+
+def parse_file(filename):
+    """Parse a PDB or mmCIF file (chosen from the suffix) into a Structure, bypassing the cache."""
+    if is_cif_file(filename):
+        import CIF_Parser  # imported here: CIF_Parser builds on this module
+        return CIF_Parser.parse_cif(read_bytes(filename))
+    return parse_structure(read_bytes(filename))
+
+
+def read_structure(filename):
+    """Read a PDB or mmCIF file and return its atoms as a Structure of column arrays.
+
+    When the structure cache is enabled (see Structure_Cache), a previously
+    parsed, unchanged file is loaded from the cache instead of being parsed."""
+    cache = Structure_Cache.default_cache()
+    if cache is None:
+        return parse_file(filename)
+
+    records = cache.load(filename)
+    if records is not None:
+        return Structure.from_records(records)
+    structure = parse_file(filename)
+    cache.store(filename, structure.to_records())
+    return structure
+
+
+def pdb_chain_map(structure):
+    """Map every chain ID longer than one character to an unused single-character ID, in file order.
+
+    Returns {long ID: PDB chain ID} (empty if all IDs fit); raises ValueError if
+    there are more chains than single-character IDs (see PDB_CHAIN_IDS)."""
+    chains, first = np.unique(structure.chain, return_index=True)
+    chains = chains[np.argsort(first)].tolist()
+    long_chains = [chain for chain in chains if len(chain) > 1]
+    free = [chain for chain in PDB_CHAIN_IDS if chain not in chains]
+    if len(long_chains) > len(free):
+        raise ValueError(f"{len(chains)} chains cannot be written in PDB format "
+                         f"(at most {len(PDB_CHAIN_IDS)} single-character chain IDs)")
+    return dict(zip(long_chains, free))
+
+
+def remap_chains(structure, chain_map):
+    """Return the structure with its chain IDs replaced according to `chain_map` (see pdb_chain_map)."""
+    if not chain_map:
+        return structure
+    structure = structure.select(slice(None))
+    chains, inverse = np.unique(structure.chain, return_inverse=True)
+    structure.chain = np.array([chain_map.get(chain, chain) for chain in chains.tolist()],
+                               dtype=structure.chain.dtype)[inverse]
+    return structure
+
+
+def check_pdb_limits(structure):
+    """Raise ValueError if chain IDs or residue numbers do not fit the fixed PDB columns.
+
+    Residue numbers above 9999 are written in hybrid-36 and atom serial numbers
+    above 99,999 modulo 100,000; long chain IDs must be remapped first (see
+    pdb_chain_map)."""
+    long_chains = np.unique(structure.chain[np.char.str_len(structure.chain) > 1])
+    if len(long_chains):
+        raise ValueError(f"Chain IDs longer than one character cannot be written in PDB format "
+                         f"(e.g. {', '.join(long_chains[:3])})")
+    if len(structure) and (structure.resnum.max() > PDB_MAX_RESNUM or structure.resnum.min() < PDB_MIN_RESNUM):
+        raise ValueError(f"Residue numbers outside {PDB_MIN_RESNUM}..{PDB_MAX_RESNUM} cannot be written in PDB format")
+
+
+def format_atom_lines(structure):
+    """Format the atoms of a Structure as fixed-width ATOM/HETATM records (newline terminated).
+
+    Raises ValueError for structures beyond the PDB format limits (see check_pdb_limits)."""
+    check_pdb_limits(structure)
+    # residue number fields formatted once per column; only numbers above 9999 need hybrid-36
+    resnums = np.char.rjust(structure.resnum.astype("U11"), 4)
+    wide = structure.resnum > PDB_MAX_DECIMAL_RESNUM
+    resnums[wide] = [format_resnum(resnum) for resnum in structure.resnum[wide].tolist()]
+    lines = []
+    for index in range(len(structure)):
+        name = structure.name[index]
+        element = structure.element[index]
+        # names of one-letter elements start in column 14 unless they use all four columns
+        if len(name) < 4 and len(element) < 2:
+            name = " " + name
+        x, y, z = structure.coords[index]
+        lines.append(
+            f"{'HETATM' if structure.hetero[index] else 'ATOM':<6}{structure.serial[index] % 100000:5d} "
+            f"{name:<4}{structure.altloc[index]:1}{structure.resname[index]:>3} {structure.chain[index]:1}"
+            f"{resnums[index]}{structure.icode[index]:1}   {x:8.3f}{y:8.3f}{z:8.3f}"
+            f"{structure.occupancy[index]:6.2f}{structure.bfactor[index]:6.2f}          {element:>2}\n")
+    return lines
+
+
+def iter_models(filename, chunk_size=_CHUNK_SIZE):
+    """Stream a multi-model PDB file, yielding one Structure per MODEL/ENDMDL block.
+
+    The file is read in large chunks and each model is parsed as soon as its
+    ENDMDL record arrives, so memory use is bounded by the chunk size plus one
+    model. A file without MODEL records yields a single Structure. mmCIF files
+    are parsed whole and split by model number."""
+    if is_cif_file(filename):
+        import CIF_Parser
+        yield from CIF_Parser.iter_cif_models(parse_file(filename))
+        return
+    with open_pdb(filename, 'rb') as file:
+        buffer = b""
+        search_start = 0
+        while True:
+            chunk = file.read(chunk_size)
+            buffer += chunk
+            # split off every complete model; keep the unfinished tail for the next chunk
+            end = buffer.rfind(b"ENDMDL", search_start) if chunk else len(buffer)
+            if end == -1:
+                search_start = max(len(buffer) - len(b"ENDMDL"), 0)
+                continue
+            if chunk:
+                end = buffer.find(b"\n", end)
+                end = len(buffer) if end == -1 else end + 1
+            for block in _ENDMDL_PATTERN.split(buffer[:end]):
+                structure = parse_structure(block)
+                if len(structure):
+                    yield structure
+            buffer = buffer[end:]
+            search_start = 0
+            if not chunk:
+                break
+
+
+def backbone_mask(structure):
+    """Boolean mask selecting protein backbone atoms (N, CA, C, O) in ATOM records."""
+    return ~structure.hetero & np.isin(structure.name, BACKBONE_ATOMS)
+
+
+def atom_keys(structure):
+    """Return ChainResidueAtomname identifiers for every atom, e.g. 'A48CG'."""
+    return np.char.add(np.char.add(structure.chain, structure.resnum.astype(str)), structure.name)
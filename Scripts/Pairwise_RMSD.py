@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+"""
+Blocked Pairwise RMSD
+=====================
+Memory-bounded all-vs-all Kabsch RMSD for large ensembles (AlphaFold models,
+MD frames). The upper triangle of the RMSD matrix is computed in square tiles
+sized to fit a memory budget; each tile is streamed into a memory-mapped
+`.npy` file holding the condensed matrix, and only running summary statistics
+are kept in memory.
+
+The condensed matrix is a 1-D float32 array of length M * (M - 1) / 2, in the
+same order as `itertools.combinations(range(M), 2)`:
+
+    rmsd(i, j) = condensed[i * M - i * (i + 1) // 2 + (j - i - 1)]   for i < j
+
+For a quick estimate, `estimate_mean_rmsd` samples random pairs with a fixed
+seed instead and reports the mean with a CLT confidence interval, stopping as
+soon as the interval is narrower than a tolerance.
+
+Usage:
+------
+    import Pairwise_RMSD
+    summary = Pairwise_RMSD.write_condensed_rmsd(coords, "pairs.npy", memory_mb=2048)
+    print(summary.mean, summary.percentile(50))
+
+    estimate = Pairwise_RMSD.estimate_mean_rmsd(coords, max_pairs=100000, tolerance=0.01)
+    print(estimate.mean, estimate.half_width)
+"""
+
+import time
+from statistics import NormalDist
+import numpy as np
+import Parallel
+import RMSD
+
+
+# bytes per pair while a tile is evaluated: 3x3 float64 covariance plus SVD/det workspace
+_BYTES_PER_PAIR = 9 * 8 * 4
+# pairs evaluated between two convergence checks when sampling
+SAMPLE_BATCH_SIZE = 1024
+
+
+class RunningSummary:
+    """Streaming mean/min/max and histogram-based percentiles of RMSD values."""
+
+    def __init__(self, bin_width=0.01, max_value=100.0):
+        self.bin_width = bin_width
+        self.counts = np.zeros(int(np.ceil(max_value / bin_width)) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        """Add a batch of values to the summary."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not len(values):
+            return
+        self.count += len(values)
+        self.total += values.sum()
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        bins = np.minimum((values / self.bin_width).astype(np.int64), len(self.counts) - 1)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        """Approximate q-th percentile (0-100), accurate to one bin width."""
+        if not self.count:
+            return 0.0
+        cumulative = np.cumsum(self.counts)
+        index = np.searchsorted(cumulative, q / 100.0 * self.count)
+        return min((index + 0.5) * self.bin_width, self.max)
+
+
+def condensed_index(i, j, n_models):
+    """Position of pair (i, j), i < j, in the condensed upper-triangle array."""
+    return i * n_models - i * (i + 1) // 2 + (j - i - 1)
+
+
+def tile_size(n_atoms, memory_mb):
+    """Number of models per tile side that keeps one tile within the memory budget."""
+    budget = memory_mb * 1024 ** 2
+    # two centered coordinate blocks (float64) plus the per-pair workspace
+    size = int(np.sqrt(budget / _BYTES_PER_PAIR))
+    while size > 1 and size * size * _BYTES_PER_PAIR + 2 * size * n_atoms * 3 * 8 > budget:
+        size //= 2
+    return max(size, 1)
+
+
+def iter_tiles(n_models, size, first_col=0):
+    """Yield (row_start, row_stop, col_start, col_stop) for upper-triangle tiles.
+
+    With `first_col`, only the tiles of columns first_col and beyond are
+    yielded: together they hold every pair (i, j), i < j, with j >= first_col."""
+    for row_start in range(0, n_models, size):
+        row_stop = min(row_start + size, n_models)
+        for col_start in range(max(row_start, first_col), n_models, size):
+            yield row_start, row_stop, col_start, min(col_start + size, n_models)
+
+
+def compute_tile(coords, row_start, row_stop, col_start, col_stop):
+    """Kabsch RMSD tile between models [row_start, row_stop) and [col_start, col_stop)."""
+    rows = RMSD.center(coords[row_start:row_stop])
+    cols = rows if col_start == row_start and col_stop == row_stop else RMSD.center(coords[col_start:col_stop])
+    return RMSD.cross_rmsd(rows, cols)
+
+
+def _tile_worker(bounds):
+    """Worker entry point: compute one tile of the ensemble registered as shared data."""
+    return compute_tile(Parallel.shared("pairwise_coords"), *bounds)
+
+
+def iter_computed_tiles(coords, size, jobs=1, first_col=0):
+    """Yield (bounds, tile) for every upper-triangle tile (see iter_tiles), computed across `jobs` processes.
+
+    At most `jobs` tiles exist at once (see Parallel.imap_windowed), so a tile
+    size chosen for memory_mb / jobs keeps the whole run within memory_mb."""
+    tiles = list(iter_tiles(len(coords), size, first_col))
+    results = Parallel.imap_windowed(_tile_worker, tiles, jobs=jobs, shared={"pairwise_coords": coords})
+    yield from zip(tiles, results)
+
+
+def pairwise_rmsd(coords, jobs=1, block_size=256):
+    """Return the full (M, M) RMSD matrix of an (M, N, 3) array, with tiles spread over `jobs` processes."""
+    n_models = len(coords)
+    matrix = np.zeros((n_models, n_models))
+    for (row_start, row_stop, col_start, col_stop), tile in iter_computed_tiles(coords, block_size, jobs):
+        matrix[row_start:row_stop, col_start:col_stop] = tile
+    matrix = np.triu(matrix, k=1)
+    return matrix + matrix.T
+
+
+def store_tile(condensed, tile, row_start, col_start, n_models):
+    """Copy the strict upper-triangle part of a tile into the condensed array."""
+    values = []
+    for offset, row in enumerate(tile):
+        i = row_start + offset
+        first = max(col_start, i + 1)
+        if first >= col_start + len(row):
+            continue
+        segment = row[first - col_start:]
+        start = condensed_index(i, first, n_models)
+        condensed[start:start + len(segment)] = segment
+        values.append(segment)
+    return np.concatenate(values) if values else np.empty(0)
+
+
+def write_condensed_rmsd(coords, output_npy, memory_mb=1024, jobs=1):
+    """Compute all pairwise RMSDs of an (M, N, 3) array tile by tile into a condensed `.npy` file.
+
+    The memory budget is shared by the `jobs` worker processes. Returns a
+    RunningSummary of all pair values."""
+    n_models, n_atoms, _ = coords.shape
+    n_pairs = n_models * (n_models - 1) // 2
+    condensed = np.lib.format.open_memmap(output_npy, mode='w+', dtype=np.float32, shape=(n_pairs,))
+    summary = RunningSummary()
+
+    size = tile_size(n_atoms, memory_mb / max(jobs, 1))
+    for (row_start, _, col_start, _), tile in iter_computed_tiles(coords, size, jobs):
+        summary.update(store_tile(condensed, tile, row_start, col_start, n_models))
+
+    condensed.flush()
+    del condensed
+    return summary
+
+
+class SampledMean:
+    """Running mean of sampled values with a normal-approximation (CLT) confidence interval."""
+
+    def __init__(self, confidence=0.95):
+        self.confidence = confidence
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.exact = False
+
+    def update(self, values):
+        """Add a batch of sampled values."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self.count += len(values)
+        self.total += values.sum()
+        self.total_squares += (values ** 2).sum()
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def half_width(self):
+        """Half-width of the confidence interval of the mean (0 if every pair was evaluated)."""
+        if self.exact:
+            return 0.0
+        if self.count < 2:
+            return np.inf
+        variance = max(self.total_squares - self.count * self.mean ** 2, 0.0) / (self.count - 1)
+        return self.z * np.sqrt(variance / self.count)
+
+
+def sample_pairs(n_models, size, rng):
+    """Draw `size` uniformly random pairs (i, j) of distinct models."""
+    i = rng.integers(0, n_models, size)
+    j = rng.integers(0, n_models - 1, size)
+    j += j >= i
+    return i, j
+
+
+def estimate_mean_rmsd(coords, max_pairs, tolerance=None, seed=0, time_budget=None,
+                       confidence=0.95, batch_size=SAMPLE_BATCH_SIZE):
+    """Estimate the mean pairwise RMSD of an (M, N, 3) array from random pairs.
+
+    Pairs are drawn with a fixed seed, so a run is reproducible. Sampling stops
+    after `max_pairs` pairs, after `time_budget` seconds, or as soon as the
+    confidence interval half-width drops to `tolerance` (in Angstrom). If
+    `max_pairs` covers every pair, the exact mean is computed instead. Returns
+    a SampledMean."""
+    n_models = len(coords)
+    estimate = SampledMean(confidence)
+    if n_models < 2:
+        estimate.exact = True
+        return estimate
+    if max_pairs >= n_models * (n_models - 1) // 2:
+        matrix = pairwise_rmsd(coords)
+        estimate.update(matrix[np.triu_indices(n_models, k=1)])
+        estimate.exact = True
+        return estimate
+
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+    while estimate.count < max_pairs:
+        i, j = sample_pairs(n_models, min(batch_size, max_pairs - estimate.count), rng)
+        estimate.update(RMSD.kabsch_rmsd_batch(coords[i], coords[j]))
+        if tolerance is not None and estimate.half_width <= tolerance:
+            break
+        if time_budget is not None and time.perf_counter() - started >= time_budget:
+            break
+    return estimate
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+Worker Pool Helpers
+===================
+Common multiprocessing layer for the directory-wide analyses. Tasks are
+submitted to a process pool in chunks and results are returned in the same
+order as the input, so output files are identical whatever the number of jobs.
+
+Large read-only inputs (a parsed reference structure, a stacked ensemble) are
+registered with `shared=` instead of being passed with every task, for the
+duration of that call only. On
+platforms that fork, workers inherit them copy-on-write; elsewhere they are
+sent once per worker through the pool initializer.
+
+Usage:
+------
+    import Parallel
+    jobs = Parallel.jobs_from_options(sys.argv)     # --jobs N (0 = all cores)
+    results = Parallel.map_ordered(worker, items, jobs=jobs, shared={"reference": coords})
+
+    # inside worker():
+    reference = Parallel.shared("reference")
+"""
+
+import collections
+import contextlib
+import itertools
+import multiprocessing
+import os
+
+
+_SHARED = {}
+
+
+def _init_worker(shared_data):
+    """Pool initializer used when workers are spawned instead of forked."""
+    _SHARED.update(shared_data)
+
+
+def shared(name, default=None):
+    """Return a read-only object registered with map_ordered(..., shared=...), or `default` if none was."""
+    return _SHARED.get(name, default)
+
+
+def cpu_count():
+    """Number of CPUs available to this process."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def jobs_from_options(options, default=1):
+    """Read the value of a `--jobs N` option from a list of arguments (0 means all cores)."""
+    jobs = default
+    if "--jobs" in options:
+        jobs_index = options.index("--jobs") + 1
+        if jobs_index < len(options):
+            jobs = int(options[jobs_index])
+    return cpu_count() if jobs <= 0 else jobs
+
+
+def strip_jobs_option(arguments):
+    """Return the arguments without the `--jobs N` option."""
+    if "--jobs" not in arguments:
+        return list(arguments)
+    jobs_index = arguments.index("--jobs")
+    return list(arguments[:jobs_index]) + list(arguments[jobs_index + 2:])
+
+
+@contextlib.contextmanager
+def _registered(shared):
+    """Register shared data for the duration of one map; the previous entries are restored afterwards."""
+    shared = shared or {}
+    previous = {name: _SHARED[name] for name in shared if name in _SHARED}
+    _SHARED.update(shared)
+    try:
+        yield
+    finally:
+        for name in shared:
+            del _SHARED[name]
+        _SHARED.update(previous)
+
+
+def imap_ordered(function, items, jobs=1, chunksize=None, shared=None):
+    """Lazily apply a module-level function to every item, yielding results in input order.
+
+    Workers run ahead of the consumer and finished results wait in the parent,
+    so this is meant for small results; use imap_windowed for large ones
+    (parsed structures, RMSD tiles)."""
+    items = list(items)
+    with _registered(shared):
+        if jobs <= 1 or len(items) <= 1:
+            for item in items:
+                yield function(item)
+            return
+
+        jobs = min(jobs, len(items))
+        if chunksize is None:
+            chunksize = max(1, len(items) // (jobs * 4))
+
+        with _pool(jobs) as pool:
+            yield from pool.imap(function, items, chunksize=chunksize)
+
+
+def imap_windowed(function, items, jobs=1, shared=None):
+    """Like imap_ordered, but with at most `jobs` results computed or waiting at any time.
+
+    Workers cannot run ahead of the consumer, so when every result is large
+    (an RMSD tile) the memory held is bounded by `jobs` results, including the
+    one being consumed."""
+    items = list(items)
+    with _registered(shared):
+        if jobs <= 1 or len(items) <= 1:
+            for item in items:
+                yield function(item)
+            return
+
+        jobs = min(jobs, len(items))
+        with _pool(jobs) as pool:
+            remaining = iter(items)
+            pending = collections.deque(pool.apply_async(function, (item,))
+                                        for item in itertools.islice(remaining, jobs))
+            while pending:
+                result = pending.popleft().get()
+                yield result
+                del result
+                # submitted only after the consumer is done with the previous result
+                for item in remaining:
+                    pending.append(pool.apply_async(function, (item,)))
+                    break
+
+
+def _pool(jobs):
+    """Process pool whose workers see the registered shared data."""
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        initializer, initargs = None, ()
+    else:
+        context = multiprocessing.get_context()
+        initializer, initargs = _init_worker, (dict(_SHARED),)
+    return context.Pool(jobs, initializer=initializer, initargs=initargs)
+
+
+def map_ordered(function, items, jobs=1, chunksize=None, shared=None):
+    """Apply a module-level function to every item across `jobs` processes; results keep input order."""
+    return list(imap_ordered(function, items, jobs=jobs, chunksize=chunksize, shared=shared))
@@ -10,32 +10,73 @@ interactions by computing centroid distances and angles between aromatic ring sy
 
 Usage:
 ------
-    python Pi_Stacking_Analysis.py <pdb_directory> <output_csv> <atom_list>
+    python Pi_Stacking_Analysis.py <pdb_directory> <output_csv> <atom_list> [--jobs N]
+    python Pi_Stacking_Analysis.py <pdb_directory> <output_csv> --detect [--cutoff 6.0]
+           [--ring-template RES:atom1,atom2,...] [--jobs N]
 
 Arguments:
 ----------
-    - pdb_directory: Path to the directory containing PDB files.
+    - pdb_directory: Path to the directory containing PDB files, or a single
+      multi-model PDB file (NMR/MD ensemble) whose MODEL blocks are analyzed
+      as frames without splitting the file, or a coordinate store created
+      with Coord_Store.py.
     - output_csv: Name of the output CSV file to store results.
     - atom_list: List of atom groups for pi-stacking calculations in the format:
       "[['A48CG','A48CD2','A48CE2','A48CZ','A48CE1','A48CD1'],
         ['A301C5','A301C4','A301C3A','A301C7A','A301C7','A301C6']]"
+    - --jobs N (optional): Number of worker processes (0 = all cores, default: 1).
+
+Ring detection (--detect):
+--------------------------
+    Instead of an atom list, every aromatic ring is found automatically: the
+    side chains of PHE, TYR, TRP (both rings) and HIS, plus ligand rings
+    registered with --ring-template (repeatable; atom names of one ring, e.g.
+    --ring-template "LIG:C1,C2,C3,C4,C5,C6"). Ring pairs with centroids closer
+    than the cutoff (default 6.0 Å) are found with a cell list, so the cost
+    grows linearly with the number of rings, and each pair is classified as:
+        parallel : planes within 30 degrees, centroids offset by at most 1.5 Å
+        offset   : planes within 30 degrees, larger lateral offset (displaced)
+        T-shaped : planes at 60-90 degrees
+        tilted   : anything in between
+    One CSV row is written per ring pair and structure:
+    PDB,Ring1,Ring2,Distance,Angle,Offset,Type
 
 Example:
 --------
     python Pi_Stacking_Analysis.py ./pdbs/ results.csv "[['A48CG','A48CD2','A48CE2','A48CZ','A48CE1','A48CD1'],['A301C5','A301C4','A301C3A','A301C7A','A301C7','A301C6']]"
+    python Pi_Stacking_Analysis.py ./pdbs/ stacking.csv --detect --ring-template "LIG:C5,C4,C3A,C7A,C7,C6" --jobs 8
 
 Output:
 -------
-    - A CSV file containing centroid distances and angles between aromatic groups.
+    - A CSV file containing centroid distances and angles between aromatic
+      groups (one Distance/Angle column pair per group pair).
 """
 
 
 import numpy as np
-from math import pow
-from math import sqrt
-from math import acos
+from functools import partial
 from os import listdir
+from os.path import isfile
 import sys
+import PDB_Parser
+import Parallel
+import Coord_Store
+
+# aromatic side-chain rings (atom names of each ring, per residue name)  -------
+_PHE_RING = ['CG','CD1','CD2','CE1','CE2','CZ']
+_HIS_RING = ['CG','ND1','CD2','CE1','NE2']
+RING_TEMPLATES = {'PHE': [_PHE_RING], 'TYR': [_PHE_RING],
+                  'TRP': [['CD2','CE2','CE3','CZ2','CZ3','CH2'],
+                          ['CG','CD1','NE1','CE2','CD2']],
+                  'HIS': [_HIS_RING], 'HID': [_HIS_RING], 'HIE': [_HIS_RING],
+                  'HIP': [_HIS_RING]}
+
+# stacking classification thresholds (Angstrom, degrees)
+STACKING_CUTOFF = 6.0
+PARALLEL_MAX_ANGLE = 30.0
+T_SHAPED_MIN_ANGLE = 60.0
+PARALLEL_MAX_OFFSET = 1.5
+#------------------------------------------------------------------------------
 
 # extract specific pdb coordinates  -------------------------------------------
 def Extract_PDB_Coords(_inputfile, _atoms):
@@ -45,46 +86,262 @@ def Extract_PDB_Coords(_inputfile, _atoms):
     formatted: ChainResidueAtomname, i.e. A123HA for chain A, residue 123, atom
     HA."""   
     
-    # create an empty list for the extraction of coordinates
-    _listlength = len(_atoms)
-    _crdlist = [[] for _it in range(_listlength)]
-    # open and read the pdb file line-by-line
-    _pdb = open(_inputfile, 'r')
-    for _line in _pdb:
-        _record = _line[0:6]
-        _record = _record.replace(' ', '')
-        # identify if the entry is for a set of atomic coordinates
-        if _record == 'ATOM' or _record == 'HETATM':
-            _chain = _line[21]
-            _chain = _chain.replace(' ', '')
-            _residue = _line[22:26]
-            _residue = _residue.replace(' ', '')
-            _atom = _line[12:16]
-            _atom = _atom.replace(' ', '')
-            _name = _chain+_residue+_atom
-            # compare atom to list of desired atoms
-            _it = 0
-            _read = True
-            while _read and _it < _listlength:
-                if _name == _atoms[_it]:
-                    _read = False
-                else:
-                    _it = _it + 1
-            # if atom matches, read coordiantes and place in crd list
-            if _read is False:
-                _x = _line[30:38]
-                _x = _x.replace(' ', '')
-                _x = float(_x)
-                _y = _line[38:46]
-                _y = _y.replace(' ', '')
-                _y = float(_y)
-                _z = _line[46:54]
-                _z = _z.replace(' ', '')
-                _z = float(_z)
-                _crdlist[_it] = [_x, _y, _z]
-    # close the pdb file and return the coordinate list
-    _pdb.close()
-    return(_crdlist)
+    return(Extract_PDB_Groups(_inputfile, [_atoms])[0])
+#------------------------------------------------------------------------------
+
+
+# extract several groups of pdb coordinates in one pass  ----------------------
+def Extract_PDB_Groups(_inputfile, _groups):
+    """Extracts the coordinates of several atom groups from a pdb file, which
+    is read only once regardless of the number of groups. The groups are lists
+    of ChainResidueAtomname strings (see Extract_PDB_Coords); a list of
+    coordinate lists is returned in the same nesting."""
+    
+    _structure = PDB_Parser.read_structure(_inputfile)
+    return(Select_Groups(_structure, _groups))
+#------------------------------------------------------------------------------
+
+
+# resolve atom groups in a parsed structure  ----------------------------------
+def Group_Indices(_structure, _groups):
+    """Resolves the atom groups against a parsed structure with a hashed
+    lookup and returns a (groups, atoms) array of atom indices, padded with
+    -1 for missing atoms and shorter groups. Only atoms requested by at least
+    one group enter the index."""
+    
+    # keep only the atoms requested by any group (one vectorized membership test)
+    _wanted = list({_atom for _group in _groups for _atom in _group})
+    _keys = PDB_Parser.atom_keys(_structure)
+    _matches = np.nonzero(np.isin(_keys, _wanted))[0]
+    # map ChainResidueAtomname to the atom index (last occurrence wins)
+    _index = dict(zip(_keys[_matches].tolist(), _matches.tolist()))
+    _natoms = max(len(_group) for _group in _groups)
+    _indices = np.full((len(_groups), _natoms), -1, dtype=int)
+    for _i, _group in enumerate(_groups):
+        for _j, _atom in enumerate(_group):
+            _indices[_i, _j] = _index.get(_atom, -1)
+    return(_indices)
+
+def Select_Groups(_structure, _groups):
+    """Resolves the atom groups against a parsed structure (see Group_Indices)
+    and returns their coordinates, leaving missing atoms as empty lists."""
+    
+    _indices = Group_Indices(_structure, _groups)
+    _crds = []
+    for _i, _group in enumerate(_groups):
+        _crdlist = []
+        for _j in range(len(_group)):
+            if _indices[_i, _j] >= 0:
+                _crdlist.append(_structure.coords[_indices[_i, _j]].astype(float).tolist())
+            else:
+                _crdlist.append([])
+        _crds.append(_crdlist)
+    return(_crds)
+#------------------------------------------------------------------------------
+
+
+# pad atom groups into a single array  ----------------------------------------
+def Pad_Groups(_crds):
+    """Convert nested coordinate groups (see Compute_Geometry) into a
+    (groups, atoms, 3) array. Groups with fewer atoms, and atoms that were not
+    found (empty lists), are padded with NaN; Ring_Planes gives NaN geometry
+    for groups left with fewer than 3 atoms."""
+    
+    _natoms = max(len(_group) for _group in _crds)
+    _array = np.full((len(_crds), _natoms, 3), np.nan)
+    for _i, _group in enumerate(_crds):
+        for _j, _crd in enumerate(_group):
+            if len(_crd) == 3:
+                _array[_i, _j] = _crd
+    return(_array)
+#------------------------------------------------------------------------------
+
+
+# batched ring geometry  ------------------------------------------------------
+def Ring_Geometry(_crds):
+    """Compute ring geometry for many frames and groups at once. Expects a
+    (..., groups, atoms, 3) array (e.g. frames x groups x atoms x 3) padded with
+    NaN for missing atoms, and returns a dictionary of arrays:
+        centroids : (..., groups, 3) centroid of each group
+        normals   : (..., groups, 3) unit normal of the best-fit plane
+        distances : (..., pairs) centroid-centroid distance per group pair
+        angles    : (..., pairs) angle between ring planes (0-90 degrees)
+        offsets   : (..., pairs) lateral displacement of the second centroid
+                    from the normal axis of the first ring
+    Pairs follow the order (0,1), (0,2), ..., (1,2), ... The plane normal is
+    the eigenvector of the smallest eigenvalue of each group's covariance
+    matrix, computed with one batched eigh over all frames and groups."""
+    
+    _cents, _norms = Ring_Planes(_crds)
+    # geometry for every group pair i < j
+    _i, _j = np.triu_indices(np.shape(_crds)[-3], k=1)
+    _geometry = Pair_Geometry(_cents, _norms, _i, _j)
+    _geometry.update({'centroids': _cents, 'normals': _norms})
+    return(_geometry)
+
+def Ring_Planes(_crds):
+    """Centroids and unit plane normals of (..., groups, atoms, 3) ring
+    coordinates padded with NaN (see Ring_Geometry). Groups with fewer than 3
+    resolved atoms define no plane: their centroid and normal are NaN, and so
+    is every pair geometry they take part in."""
+    
+    _crds = np.asarray(_crds, dtype=float)
+    _resolved = ~np.isnan(_crds).any(axis=-1)
+    _counts = _resolved.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        _cents = np.nansum(_crds, axis=-2) / _counts[..., None]
+    _centered = np.nan_to_num(_crds - _cents[..., None, :])
+    _cov = np.einsum('...ai,...aj->...ij', _centered, _centered)
+    _norms = np.linalg.eigh(_cov)[1][..., 0]
+    _undefined = _counts < 3
+    _cents[_undefined] = np.nan
+    _norms[_undefined] = np.nan
+    return(_cents, _norms)
+
+def Pair_Geometry(_cents, _norms, _i, _j):
+    """Distances, plane angles (0-90 degrees) and lateral offsets (from the
+    normal axis of ring i) for the ring pairs (i, j) given as index arrays."""
+    
+    _vecs = _cents[..., _j, :] - _cents[..., _i, :]
+    _dists = np.linalg.norm(_vecs, axis=-1)
+    _cos = np.abs(np.sum(_norms[..., _i, :] * _norms[..., _j, :], axis=-1))
+    _angles = np.degrees(np.arccos(np.clip(_cos, 0.0, 1.0)))
+    _along = np.sum(_vecs * _norms[..., _i, :], axis=-1)
+    _offsets = np.sqrt(np.maximum(_dists ** 2 - _along ** 2, 0.0))
+    return({'distances': _dists, 'angles': _angles, 'offsets': _offsets})
+#------------------------------------------------------------------------------
+
+
+# aromatic ring detection  ----------------------------------------------------
+def Register_Ring_Template(_resname, _ring):
+    """Register the atom names of one aromatic ring of a ligand (or any
+    residue) so that ring detection finds it, e.g. ('LIG', ['C1','C2',...])."""
+    
+    RING_TEMPLATES.setdefault(_resname, []).append(list(_ring))
+    return(None)
+
+def Find_Rings(_structure, _templates=None):
+    """Find every templated ring in a parsed structure. Returns a (rings,
+    atoms) array of atom indices padded with -1, and a label per ring
+    (ChainResidueResname, e.g. A48PHE; TRP rings get a suffix :1 / :2). Only
+    rings with all their atoms present are returned. Each template is
+    resolved with a few vectorized lookups, so the cost is linear in the
+    number of atoms."""
+    
+    _templates = RING_TEMPLATES if _templates is None else _templates
+    _natoms = max(len(_ring) for _rings in _templates.values() for _ring in _rings)
+    _residues = np.char.add(np.char.add(_structure.chain, _structure.resnum.astype(str)),
+                            _structure.icode)
+    _indices = []
+    _labels = []
+    _firsts = []
+    for _resname, _rings in _templates.items():
+        _in_residue = _structure.resname == _resname
+        if not _in_residue.any():
+            continue
+        for _k, _ring in enumerate(_rings):
+            _atoms = np.nonzero(_in_residue & np.isin(_structure.name, _ring))[0]
+            _keys, _first, _residue = np.unique(_residues[_atoms], return_index=True,
+                                                return_inverse=True)
+            _position = np.array([_ring.index(_name) for _name in _structure.name[_atoms]], dtype=int)
+            _ring_index = np.full((len(_keys), _natoms), -1, dtype=int)
+            # assigned in reverse so the first of duplicated atoms (alternate locations) wins
+            _ring_index[_residue[::-1], _position[::-1]] = _atoms[::-1]
+            _complete = (_ring_index[:, :len(_ring)] >= 0).all(axis=1)
+            _suffix = ':'+str(_k+1) if len(_rings) > 1 else ''
+            _indices.append(_ring_index[_complete])
+            _labels.extend(_key+_resname+_suffix for _key in _keys[_complete].tolist())
+            _firsts.append(_atoms[_first][_complete])
+    if not _indices:
+        return(np.zeros((0, _natoms), dtype=int), [])
+    # report rings in the order they appear in the file
+    _order = np.argsort(np.concatenate(_firsts), kind='stable')
+    return(np.concatenate(_indices)[_order], [_labels[_o] for _o in _order])
+
+def Ring_Coordinates(_coords, _indices):
+    """Gather (..., rings, atoms, 3) ring coordinates from (..., atoms, 3)
+    coordinates, padding with NaN (see Ring_Planes)."""
+    
+    _crds = np.asarray(_coords[..., np.maximum(_indices, 0), :], dtype=float)
+    _crds[..., _indices < 0, :] = np.nan
+    return(_crds)
+#------------------------------------------------------------------------------
+
+
+# cell-list neighbour search  -------------------------------------------------
+def Neighbour_Pairs(_points, _cutoff):
+    """Return index arrays (i, j), i < j, of all point pairs within the
+    cutoff. Points are binned into cubic cells of the cutoff size and only the
+    27 surrounding cells are searched, so for a bounded density the cost is
+    linear in the number of points."""
+    
+    _points = np.asarray(_points, dtype=float)
+    if len(_points) < 2:
+        return(np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+    # cell coordinates start at 1 so that neighbouring cells never wrap around
+    _cells = np.floor((_points - _points.min(axis=0)) / _cutoff).astype(np.int64) + 1
+    _dims = _cells.max(axis=0) + 2
+    _keys = (_cells[:, 0] * _dims[1] + _cells[:, 1]) * _dims[2] + _cells[:, 2]
+    _order = np.argsort(_keys, kind='stable')
+    _sorted = _keys[_order]
+    _pairs_i = []
+    _pairs_j = []
+    for _dx in (-1, 0, 1):
+        for _dy in (-1, 0, 1):
+            for _dz in (-1, 0, 1):
+                _target = _keys + (_dx * _dims[1] + _dy) * _dims[2] + _dz
+                _lo = np.searchsorted(_sorted, _target, side='left')
+                _counts = np.searchsorted(_sorted, _target, side='right') - _lo
+                # expand every point into the members of its target cell
+                _i = np.repeat(np.arange(len(_points)), _counts)
+                _slot = np.arange(len(_i)) - np.repeat(np.cumsum(_counts) - _counts, _counts)
+                _j = _order[np.repeat(_lo, _counts) + _slot]
+                _keep = _i < _j
+                _pairs_i.append(_i[_keep])
+                _pairs_j.append(_j[_keep])
+    _i = np.concatenate(_pairs_i)
+    _j = np.concatenate(_pairs_j)
+    _close = np.linalg.norm(_points[_j] - _points[_i], axis=-1) <= _cutoff
+    _i, _j = _i[_close], _j[_close]
+    _sort = np.lexsort((_j, _i))
+    return(_i[_sort], _j[_sort])
+
+def Classify_Stacking(_angles, _offsets):
+    """Label ring pairs as parallel, offset, T-shaped or tilted from the
+    angle between the ring planes and the lateral centroid offset."""
+    
+    _types = np.full(len(_angles), 'tilted', dtype=object)
+    _flat = _angles <= PARALLEL_MAX_ANGLE
+    _types[_flat & (_offsets <= PARALLEL_MAX_OFFSET)] = 'parallel'
+    _types[_flat & (_offsets > PARALLEL_MAX_OFFSET)] = 'offset'
+    _types[_angles >= T_SHAPED_MIN_ANGLE] = 'T-shaped'
+    return(_types)
+
+def Detect_Stacking(_cents, _norms, _labels, _cutoff=STACKING_CUTOFF):
+    """Find and classify the stacked ring pairs of one structure from ring
+    centroids and normals. Returns rows [ring1, ring2, distance, angle,
+    offset, type]; the offset is the smaller of the two lateral offsets."""
+    
+    _valid = np.nonzero(np.isfinite(_cents).all(axis=1))[0]
+    _i, _j = Neighbour_Pairs(_cents[_valid], _cutoff)
+    _i, _j = _valid[_i], _valid[_j]
+    _geometry = Pair_Geometry(_cents, _norms, _i, _j)
+    _offsets = np.minimum(_geometry['offsets'], Pair_Geometry(_cents, _norms, _j, _i)['offsets'])
+    _types = Classify_Stacking(_geometry['angles'], _offsets)
+    _rows = []
+    for _n in range(len(_i)):
+        _rows.append([_labels[_i[_n]], _labels[_j[_n]], float(_geometry['distances'][_n]),
+                      float(_geometry['angles'][_n]), float(_offsets[_n]), _types[_n]])
+    return(_rows)
+
+def Detect_Structure(_structure, _templates=None, _cutoff=STACKING_CUTOFF):
+    """Detect the rings of one parsed structure and classify their stacking."""
+    
+    _indices, _labels = Find_Rings(_structure, _templates)
+    if not _labels:
+        return([])
+    _cents, _norms = Ring_Planes(Ring_Coordinates(_structure.coords, _indices))
+    return(Detect_Stacking(_cents, _norms, _labels, _cutoff))
 #------------------------------------------------------------------------------
 
 
@@ -98,101 +355,182 @@ def Compute_Geometry(_crds):
     specifies two groups (i and j) of coordinates, each containing two atoms
     (1 and 2)."""
     
-    # compute centroid for each coordinate grouping
-    _cents = []
-    for _group in _crds:
-        _cent = [0.0, 0.0, 0.0]
-        _n = 0
-        for _crd in _group:
-            _n = _n + 1
-            _cent[0] = _cent[0] + _crd[0]
-            _cent[1] = _cent[1] + _crd[1]
-            _cent[2] = _cent[2] + _crd[2]
-        _cent = [_cent[0] / _n, _cent[1] / _n, _cent[2] / _n]
-        _cents.append(_cent)
-    # compute the distance between each pair of centroids
-    _dists = []
-    for _i in range(0, len(_crds) - 1):
-        for _j in range(_i + 1, len(_crds)):
-            _dist = 0.0
-            _dist = _dist + pow(_cents[_i][0] - _cents[_j][0], 2)
-            _dist = _dist + pow(_cents[_i][1] - _cents[_j][1], 2)
-            _dist = _dist + pow(_cents[_i][2] - _cents[_j][2], 2)
-            _dist = sqrt(_dist)
-            _dists.append(_dist)
-    # compute the norm for each coordinate grouping by calculation of each
-    # matrix's singular value decomposition
-    _norms = []
-    for _group in _crds:
-        _matrix = np.array(_group, dtype=float)
-        _matrix = np.transpose(_matrix)
-        _U, _s, _V = np.linalg.svd(_matrix)
-        _norms.append([_U[0][2], _U[1][2], _U[2][2]])
-    # compute the angle between norms for pairs of groups
-    _angles = []
-    for _i in range(0, len(_crds) - 1):
-        for _j in range(_i + 1, len(_crds)):
-            _angle = _norms[_i][0] * _norms[_j][0]\
-                   + _norms[_i][1] * _norms[_j][1]\
-                   + _norms[_i][2] * _norms[_j][2]
-            _length_i = pow(_norms[_i][0], 2)\
-                      + pow(_norms[_i][1], 2)\
-                      + pow(_norms[_i][2], 2)
-            _length_i = sqrt(_length_i)
-            _length_j = pow(_norms[_j][0], 2)\
-                      + pow(_norms[_j][1], 2)\
-                      + pow(_norms[_j][2], 2)
-            _length_j = sqrt(_length_j)
-            _length = _length_i * _length_j
-            _angle = (acos(_angle / _length)) * 57.2957795
-            _angles.append(_angle)
+    _geometry = Ring_Geometry(Pad_Groups(_crds))
     # return centroid distances and angles for each group pair
-    return(_dists, _angles)
+    return(_geometry['distances'].tolist(), _geometry['angles'].tolist())
 #------------------------------------------------------------------------------
 
 # helper function to read directory and return files  -------------------------
-def Read_Dir(_directory, _ext='.pdb'):
+def Read_Dir(_directory, _ext=None):
     """Return a list of the files in the directory (string) provided they share
-    the same extension (string)."""
+    the same extension (string). By default every coordinate file is listed,
+    compressed or not (.pdb, .ent, .pdb.gz, ...; see PDB_Parser)."""
     
     # list files in the directory, with the extension, and return list
     _filelist = []
     _files = listdir(_directory)
     for _file in _files:
-        if _file[-len(_ext):] == _ext:
+        if _ext is None and PDB_Parser.is_structure_file(_file):
+            _filelist.append(_file)
+        elif _ext is not None and _file[-len(_ext):] == _ext:
             _filelist.append(_file)
     return(_filelist)
 #------------------------------------------------------------------------------
 
 # helper function for pdb analysis  -------------------------------------------
-def Analyze_Pi_Stacking(_directory, _pdblist, _atoms):
-    """Read and analyzed the pdb list."""
+def Analyze_PDB(_path, _atoms):
+    """Extract the atom groups (list of lists of atom names) from one pdb file
+    as a padded (groups, atoms, 3) array (worker entry point). The file is
+    read once for all groups."""
     
-    _geoms = []
-    for _pdbs in _pdblist:
-        _geom = []
-        _crds = []
-        for _group in _atoms:
-            _crd = Extract_PDB_Coords(_directory+_pdbs, _group)
-            _crds.append(_crd)
+    _crds = Extract_PDB_Groups(_path, _atoms)
+    return(Pad_Groups(_crds))
+
+def Detect_PDB(_path, _templates=None, _cutoff=STACKING_CUTOFF):
+    """Detect and classify ring stacking in one pdb file (worker entry
+    point); see Detect_Structure."""
+    
+    return(Detect_Structure(PDB_Parser.read_structure(_path), _templates, _cutoff))
 
-        _dist, _angle = Compute_Geometry(_crds)
+def Detect_Pi_Stacking(_source, _cutoff=STACKING_CUTOFF, _jobs=1):
+    """Ring detection mode for a directory, a multi-model pdb file or a
+    coordinate store. Returns one list of stacking rows per structure (see
+    Detect_Stacking) and the structure names. Store rings are found once on
+    the shared topology; directories are processed in parallel."""
+    
+    if Coord_Store.is_store(_source):
+        _store = Coord_Store.open_store(_source)
+        _indices, _labels = Find_Rings(_store.topology)
+        _results = []
+        for _model in range(len(_store)):
+            if not _labels:
+                _results.append([])
+                continue
+            _cents, _norms = Ring_Planes(Ring_Coordinates(_store.coords[_model], _indices))
+            _results.append(Detect_Stacking(_cents, _norms, _labels, _cutoff))
+        return(_results, list(_store.names))
+    if isfile(_source):
+        _prefix = PDB_Parser.structure_stem(_source)
+        _results = []
+        _names = []
+        for _structure in PDB_Parser.iter_models(_source):
+            _results.append(Detect_Structure(_structure, _cutoff=_cutoff))
+            _names.append(_prefix+'_'+str(_structure.model[0]))
+        return(_results, _names)
+    _names = Read_Dir(_source)
+    _paths = [_source+_pdb for _pdb in _names]
+    # templates passed explicitly: spawned workers do not see --ring-template additions
+    _results = Parallel.map_ordered(partial(Detect_PDB, _templates=RING_TEMPLATES, _cutoff=_cutoff),
+                                    _paths, jobs=_jobs)
+    return(_results, _names)
 
-        _geom.append([_dist, _angle])
-        _geoms.append(_geom)
+def Analyze_Pi_Stacking(_directory, _pdblist, _atoms, _jobs=1):
+    """Read and analyzed the pdb list, optionally across several processes.
+    The geometry of all files is computed in one batched call, and results
+    are returned in the order of the pdb list."""
+    
+    _paths = [_directory+_pdbs for _pdbs in _pdblist]
+    _crds = Parallel.map_ordered(partial(Analyze_PDB, _atoms=_atoms), _paths, jobs=_jobs)
+    if not _crds:
+        return([])
+    _geometry = Ring_Geometry(np.stack(_crds))
+    _geoms = []
+    for _dist, _angle in zip(_geometry['distances'], _geometry['angles']):
+        _geoms.append([[_dist.tolist(), _angle.tolist()]])
     return(_geoms)
 #------------------------------------------------------------------------------
 
+# helper function for multi-model (trajectory) analysis  ----------------------
+def Analyze_Trajectory(_pdbfile, _atoms):
+    """Stream the MODEL blocks of a multi-model pdb file (NMR/MD ensemble)
+    and analyze every frame without splitting the file. Returns the geometry
+    list (as Analyze_Pi_Stacking) and a name per frame (file_model)."""
+    
+    _prefix = PDB_Parser.structure_stem(_pdbfile)
+    _crds = []
+    _names = []
+    for _structure in PDB_Parser.iter_models(_pdbfile):
+        _crds.append(Pad_Groups(Select_Groups(_structure, _atoms)))
+        _names.append(_prefix+'_'+str(_structure.model[0]))
+    if not _crds:
+        return([], [])
+    _geometry = Ring_Geometry(np.stack(_crds))
+    _geoms = []
+    for _dist, _angle in zip(_geometry['distances'], _geometry['angles']):
+        _geoms.append([[_dist.tolist(), _angle.tolist()]])
+    return(_geoms, _names)
+#------------------------------------------------------------------------------
+
+# helper function for coordinate store analysis  ------------------------------
+def Analyze_Store(_store_dir, _atoms):
+    """Analyze every model of a coordinate store (see Coord_Store.py). The
+    atom groups are resolved once against the shared topology and gathered
+    for all models with one fancy-indexing operation."""
+    
+    _store = Coord_Store.open_store(_store_dir)
+    if not len(_store):
+        return([], [])
+    _indices = Group_Indices(_store.topology, _atoms)
+    _crds = np.asarray(_store.coords[:, np.maximum(_indices, 0)], dtype=float)
+    _crds[:, _indices < 0] = np.nan
+    _geometry = Ring_Geometry(_crds)
+    _geoms = []
+    for _dist, _angle in zip(_geometry['distances'], _geometry['angles']):
+        _geoms.append([[_dist.tolist(), _angle.tolist()]])
+    return(_geoms, list(_store.names))
+#------------------------------------------------------------------------------
+
 def Save_Results(_csvfile, _geometry, _pdbs):
+    """Write one row per structure with the distance and angle of every group
+    pair. With two groups the header is PDB,Distance,Angle; with more groups
+    the columns are named after the pair, e.g. Distance_1_2,Angle_1_2."""
+    
+    _npairs = max((len(_geo[0]) for _geom in _geometry for _geo in _geom), default=1)
     _wfile = open(_csvfile, 'w')
-    _wfile.write('PDB,Distance,Angle')
+    if _npairs == 1:
+        _wfile.write('PDB,Distance,Angle')
+    else:
+        _ngroups = int(round((1 + np.sqrt(1 + 8 * _npairs)) / 2))
+        _wfile.write('PDB')
+        for _i, _j in zip(*np.triu_indices(_ngroups, k=1)):
+            _pair = str(_i+1)+'_'+str(_j+1)
+            _wfile.write(',Distance_'+_pair+',Angle_'+_pair)
     for _geom, _pdb in zip(_geometry, _pdbs):
         _wfile.write('\n'+_pdb)
         for _geo in _geom:
-            _wfile.write(','+str(_geo[0][0])+','+str(_geo[1][0]))
+            for _dist, _angle in zip(_geo[0], _geo[1]):
+                _wfile.write(','+str(_dist)+','+str(_angle))
     _wfile.close()
     return(None)
 
+def Save_Stacking(_csvfile, _results, _pdbs):
+    """Write the detected ring pairs, one row per pair and structure."""
+    
+    _wfile = open(_csvfile, 'w')
+    _wfile.write('PDB,Ring1,Ring2,Distance,Angle,Offset,Type')
+    for _rows, _pdb in zip(_results, _pdbs):
+        for _row in _rows:
+            _wfile.write('\n'+_pdb+','+','.join(str(_value) for _value in _row))
+    _wfile.close()
+    return(None)
+
+def Option_Values(_arguments, _flag):
+    """Return the values following every occurrence of a command-line flag,
+    and the arguments with those flags and values removed."""
+    
+    _values = []
+    _remaining = []
+    _skip = False
+    for _n, _argument in enumerate(_arguments):
+        if _skip:
+            _skip = False
+        elif _argument == _flag and _n + 1 < len(_arguments):
+            _values.append(_arguments[_n + 1])
+            _skip = True
+        else:
+            _remaining.append(_argument)
+    return(_values, _remaining)
+
 # RUN SCRIPT HERE  ------------------------------------------------------------
 
 def save_output(results, output_csv):
@@ -205,16 +543,44 @@ def save_output(results, output_csv):
 
 def main():
     """Main function to process the PDB directory and compute pi-stacking interactions."""
-    if len(sys.argv) != 4:
-        print("Usage: python pi_angles_modified.py <pdb_directory> <output_csv> <atom_list>")
+    arguments = Parallel.strip_jobs_option(sys.argv)
+    if "--detect" in arguments:
+        templates, arguments = Option_Values(arguments, "--ring-template")
+        cutoffs, arguments = Option_Values(arguments, "--cutoff")
+        arguments.remove("--detect")
+        if len(arguments) != 3:
+            print("Usage: python Pi_Stacking_Analysis.py <pdb_directory> <output_csv> --detect [--cutoff 6.0] [--ring-template RES:atom1,atom2,...] [--jobs N]")
+            sys.exit(1)
+        for template in templates:
+            resname, _, ring = template.partition(":")
+            if not ring:
+                print(f"Error: invalid ring template '{template}' (expected RES:atom1,atom2,...)")
+                sys.exit(1)
+            Register_Ring_Template(resname, ring.split(","))
+        cutoff = float(cutoffs[-1]) if cutoffs else STACKING_CUTOFF
+        results, pdb_files = Detect_Pi_Stacking(arguments[1], cutoff, Parallel.jobs_from_options(sys.argv))
+        Save_Stacking(arguments[2], results, pdb_files)
+        print(f"Found {sum(len(rows) for rows in results)} stacked ring pairs in {len(pdb_files)} structures. Results saved to {arguments[2]}")
+        return
+
+    if len(arguments) != 4:
+        print("Usage: python pi_angles_modified.py <pdb_directory> <output_csv> <atom_list> [--jobs N]")
         sys.exit(1)
     
-    pdb_directory = sys.argv[1]
-    output_csv = sys.argv[2]
-    ring_atoms = eval(sys.argv[3])
+    pdb_directory = arguments[1]
+    output_csv = arguments[2]
+    ring_atoms = eval(arguments[3])
+    jobs = Parallel.jobs_from_options(sys.argv)
     
-    pdb_files = Read_Dir(pdb_directory)
-    results = Analyze_Pi_Stacking(pdb_directory, pdb_files, ring_atoms)
+    if Coord_Store.is_store(pdb_directory):
+        # a binary coordinate store: all models share one topology
+        results, pdb_files = Analyze_Store(pdb_directory, ring_atoms)
+    elif isfile(pdb_directory):
+        # a single multi-model pdb file: analyze each MODEL as a frame
+        results, pdb_files = Analyze_Trajectory(pdb_directory, ring_atoms)
+    else:
+        pdb_files = Read_Dir(pdb_directory)
+        results = Analyze_Pi_Stacking(pdb_directory, pdb_files, ring_atoms, jobs)
     Save_Results(output_csv, results , pdb_files)
     print(f"Analysis complete. Results saved to {output_csv}")
 
@@ -23,9 +23,11 @@ Features:
   - Required for force field parameterization in many computational tools.
 
 - **Alternate Conformation Handling (`--keep-highest-occup`)**
-  - Retains only the conformation with the highest occupancy for each atom.
+  - Retains one whole conformation per residue: the one with the highest summed occupancy, or the alternate location chosen with `--altloc <ID>`.
+  - Residues are distinguished by chain, residue number, insertion code and record type (ATOM/HETATM).
   - Modifies residue names to remove alternate location indicators (e.g., AMET → MET).
   - Sets occupancy to 1.00 for all retained atoms to standardize the structure.
+  - Atom serial numbers are assigned once, after the conformers are chosen, so they have no gaps.
 
 - **Chain Removal (`--remove-chains <chains>`)**
   - Deletes specific chains from the structure.
@@ -36,6 +38,11 @@ Features:
   - Deletes residues with chain specification (e.g., A/10-20, B/5-8, B/123, 123).
   - Supports range-based removal and single residue deletions.
   - Can remove residues across multiple chains or globally.
+  - Insertion codes are supported (e.g., A/52A, A/50-52B); a residue number without an insertion code covers all of its insertion codes.
+
+- **Atom Selections (`--select <expr>`, `--remove <expr>`)**
+  - Keep (or remove) the atoms matching a selection expression such as "protein and not hydrogen" or "chain A and resid 10-20" (grammar in Atom_Selection.py).
+  - Records are parsed in blocks into column arrays and the compiled expression is evaluated as NumPy masks.
 
 - **Residue Renumbering (`--renumber`)**
   - Restarts residue numbering from 1 for each chain.
@@ -45,6 +52,24 @@ Features:
 Usage:
 ------
     python Process_PDB.py <input_pdb> <output_pdb> [options]
+    python Process_PDB.py --batch <input_dir | "glob" | file_list.txt> <output_dir> [options] [--jobs N]
+
+Batch mode applies the same options to every input file (all .pdb/.ent files of a directory,
+a quoted glob pattern, or a text file with one path per line) and writes the results to
+<output_dir> under the same file names, using a process pool. A per-file success/failure
+summary is printed at the end.
+
+Compressed files (.gz, .bz2, .xz) are read directly, and the output is compressed when
+<output_pdb> ends in one of these suffixes. In batch mode outputs keep the compression of
+their input unless `--compress gz|bz2|xz|none` is given.
+
+mmCIF inputs (.cif, .cif.gz) are converted to PDB records before processing, so the output
+is always in PDB format (batch outputs are named .pdb). Each model of a multi-model mmCIF
+file is processed separately and written between MODEL/ENDMDL records. Chain IDs longer
+than one character are replaced by unused single-character IDs (the mapping is printed, and
+--remove-chains/--remove-residues refer to the new IDs); residue numbers above 9999 are
+written in hybrid-36 (A000 = 10000) and atom serial numbers above 99,999 wrap around, as in
+other PDB writers.
 
 Options:
 --------
@@ -52,12 +77,21 @@ Options:
     --remove-ligands       Remove all ligands (HETATM records, except HOH if not using --remove-solvent)
     --remove-hydrogens     Remove hydrogen atoms and renumber atoms
     --keep-highest-occup   Keep only the conformation with the highest occupancy, rename residues correctly, renumber atoms, and set occupancy to 1
+    --altloc <ID>          With --keep-highest-occup, keep this alternate location (e.g., B) wherever it exists
     --remove-chains <chains> Remove specific chains (comma-separated, e.g., A,B,C)
     --remove-residues <list> Remove specific residues with chain specification (e.g., A/10-20,B/5-8,B/123,123)
+    --select <expr>        Keep only the atoms matching an Atom_Selection.py expression (e.g., "protein and not hydrogen")
+    --remove <expr>        Remove the atoms matching an Atom_Selection.py expression (e.g., "resname SO4 GOL or water")
     --renumber             Renumber residues from 1 per chain, ensuring ligands and solvent continue numbering from the last residue of their associated chain
+    --compress <type>      Batch mode only: compress every output with gz, bz2 or xz (none = plain text)
 
 Examples:
 ---------
+0️⃣ **Clean a Whole Directory on 16 Cores**
+```bash
+python Process_PDB.py --batch pdb_mirror/ cleaned/ --remove-solvent --remove-ligands --jobs 16
+```
+
 1️⃣ **Remove Water, Ligands, and Hydrogen Atoms**
 ```bash
 python Process_PDB.py input.pdb output.pdb --remove-solvent --remove-ligands --remove-hydrogens
@@ -101,157 +135,426 @@ This script provides an **efficient and customizable** approach to preparing **P
 """
 
 import sys
+import os
 import re
+import glob
+import bisect
+from functools import partial
+import PDB_Parser
+import CIF_Parser
+import Parallel
+import Atom_Selection
+
+# records parsed and masked together by --select/--remove
+SELECTION_BLOCK_SIZE = 65536
+
+# ---------------------------------------------------------------------------
+# Record predicates (True means the record is removed)
+# ---------------------------------------------------------------------------
+
+def is_atom_record(line):
+    """True for ATOM and HETATM records."""
+    return line.startswith("ATOM") or line.startswith("HETATM")
+
+def is_ligand(line):
+    """True for HETATM records that are not water molecules (HOH)."""
+    return line.startswith("HETATM") and "HOH" not in line[17:20]
+
+def is_solvent(line):
+    """True for solvent molecules (HOH)."""
+    return line.startswith("HETATM") and "HOH" in line[17:20]
+
+def is_hydrogen(line):
+    """True for hydrogen atoms (element column)."""
+    return line[76:78].strip() == "H"
+
+def chain_predicate(chains):
+    """Build a predicate matching records of the given chains (comma-separated)."""
+    chains_to_remove = set(chains.split(","))
+    return lambda line: line[21] in chains_to_remove
+
+class ResidueSelection:
+    """Compiled residue selection (e.g., A/10-20,B/5-8,B/123,A/52A,123).
+
+    Ranges are stored per chain (None for entries without a chain) as sorted,
+    merged lists of (resnum, icode) intervals, so a lookup is a binary search
+    whatever the number or length of the ranges. A residue number without an
+    insertion code covers all of its insertion codes (20 includes 20A)."""
+
+    _RANGE_PATTERN = re.compile(r"^(-?\d+)([A-Za-z]?)(?:-(-?\d+)([A-Za-z]?))?$")
+    _LAST_ICODE = "~"  # sorts after every insertion code letter
+
+    def __init__(self, residues):
+        intervals = {}
+        for entry in residues.split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            chain, _, res_range = entry.rpartition("/")
+            match = self._RANGE_PATTERN.match(res_range)
+            if not match:
+                print(f"Invalid residue specification: {entry}")
+                continue
+            start_num, start_icode, end_num, end_icode = match.groups()
+            if end_num is None:
+                end_num, end_icode = start_num, start_icode
+            start = (int(start_num), start_icode)
+            end = (int(end_num), end_icode or self._LAST_ICODE)
+            intervals.setdefault(chain or None, []).append((start, end))
+
+        self.starts = {}
+        self.ends = {}
+        for chain, chain_intervals in intervals.items():
+            merged = []
+            for start, end in sorted(chain_intervals):
+                if merged and start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self.starts[chain] = [start for start, _ in merged]
+            self.ends[chain] = [end for _, end in merged]
+
+    def contains(self, chain, resnum, icode=""):
+        """True if the residue is selected, either for its chain or by a chain-less entry."""
+        key = (resnum, icode)
+        for selected_chain in (chain, None):
+            starts = self.starts.get(selected_chain)
+            if starts:
+                index = bisect.bisect_right(starts, key) - 1
+                if index >= 0 and key <= self.ends[selected_chain][index]:
+                    return True
+        return False
+
+def residue_predicate(residues):
+    """Build a predicate matching residues with chain specification (e.g., A/10-20,B/5-8,B/123,123).
+
+    The selection is compiled once and evaluated once per residue: consecutive
+    records of the same residue reuse the previous answer. Residue numbers above
+    9999 may be hybrid-36 encoded; records whose residue number is blank or
+    malformed are never selected."""
+    selection = ResidueSelection(residues)
+    last = [None, False]
+
+    def predicate(line):
+        residue = line[21:27]
+        if residue != last[0]:
+            last[0] = residue
+            try:
+                last[1] = selection.contains(line[21], PDB_Parser.parse_resnum(line[22:26]), line[26].strip())
+            except ValueError:
+                last[1] = False
+        return last[1]
+    return predicate
+
+# ---------------------------------------------------------------------------
+# Record rewriters (streams of lines in, streams of lines out)
+# ---------------------------------------------------------------------------
+
+def choose_conformer(records, altloc=None):
+    """Return the alternate location ID to keep for one residue: the requested one if present, else the highest summed occupancy."""
+    occupancies = {}
+    for line in records:
+        if line[16] != " ":
+            occupancies[line[16]] = occupancies.get(line[16], 0.0) + float(line[54:60].strip() or 0)
+    if not occupancies:
+        return None
+    if altloc in occupancies:
+        return altloc
+    # ties go to the conformer listed first
+    return max(occupancies, key=occupancies.get)
+
+def resolve_residue_altlocs(records, altloc=None):
+    """Keep one whole conformer of a residue, clear the alternate location indicator and set occupancy to 1.
+
+    Atoms without an alternate location indicator are shared by all conformers and
+    always kept; each atom name is written once, in the original record order."""
+    chosen = choose_conformer(records, altloc)
+    seen = set()
+    for line in records:
+        if line[16] != " " and line[16] != chosen:
+            continue
+        atom_name = line[12:16]
+        if atom_name in seen:
+            continue
+        seen.add(atom_name)
+        yield f"{line[:16]} {line[17:54]}  1.00{line[60:]}"
+
+def resolve_altlocs(records, altloc=None):
+    """Resolve alternate conformations residue by residue in a single pass.
+
+    Residues are keyed on record type, chain, residue number and insertion code, so
+    HETATM groups and inserted residues are never mixed with their neighbours. Records
+    are buffered one residue at a time; atom serials are left for renumber_atoms."""
+    residue = None
+    buffer = []
+    for line in records:
+        key = (line[0:6], line[21:27])
+        if key != residue:
+            yield from resolve_residue_altlocs(buffer, altloc)
+            residue = key
+            buffer = []
+        buffer.append(line)
+    yield from resolve_residue_altlocs(buffer, altloc)
+
+def select_records(records, selection, keep=True):
+    """Keep (or, with keep=False, drop) the records matching a selection expression.
+
+    Records are parsed in blocks into column arrays so the compiled expression is
+    evaluated with a few vectorized operations per block."""
+    selection = Atom_Selection.compile_selection(selection)
+    block = []
+    for line in records:
+        block.append(line)
+        if len(block) == SELECTION_BLOCK_SIZE:
+            yield from _select_block(block, selection, keep)
+            block = []
+    yield from _select_block(block, selection, keep)
+
+def _select_block(block, selection, keep):
+    if not block:
+        return
+    data = "".join(line if line.endswith("\n") else line + "\n" for line in block).encode()
+    mask = selection.mask(PDB_Parser.parse_structure(data))
+    if len(mask) != len(block):
+        raise ValueError("Malformed ATOM/HETATM records; cannot apply the atom selection")
+    if not keep:
+        mask = ~mask
+    for line, selected in zip(block, mask):
+        if selected:
+            yield line
+
+def renumber_atoms(records):
+    """Renumber atom serial numbers sequentially from 1."""
+    for atom_number, line in enumerate(records, 1):
+        yield f"{line[:6]}{atom_number % 100000:5d}{line[11:]}"  # wraps above 99,999 like format_atom_lines
+
+def renumber_residues(records):
+    """Renumber residues sequentially from 1 per chain, ensuring ligands and solvent continue numbering from the last residue of their associated chain."""
+    residue_map = {}
+    current_resnum = {}
+    last_resnum = {}
+    
+    for line in records:
+        chain_id = line[21]
+        resnum = line[22:26]  # the field itself: decimal or hybrid-36
+        
+        # If it's a new chain and has not been seen before, start from 1
+        if chain_id not in current_resnum:
+            current_resnum[chain_id] = 1
+        
+        # If it's a known chain, continue from the last residue
+        elif chain_id in last_resnum:
+            current_resnum[chain_id] = last_resnum[chain_id] + 1
+        
+        # Assign a new residue number if we haven't seen this resnum before
+        if (chain_id, resnum) not in residue_map:
+            residue_map[(chain_id, resnum)] = current_resnum[chain_id]
+            current_resnum[chain_id] += 1
+            
+        last_resnum[chain_id] = residue_map[(chain_id, resnum)]  # Track last residue number
+        
+        # Modify the residue number in the line
+        yield line[:22] + PDB_Parser.format_resnum(residue_map[(chain_id, resnum)]) + line[26:]
+
+# ---------------------------------------------------------------------------
+# List-based helpers (kept for use from other scripts)
+# ---------------------------------------------------------------------------
 
 def parse_pdb(pdb_file):
-    """Read a PDB file and return a list of lines."""
-    with open(pdb_file, 'r') as file:
-        return file.readlines()
+    """Read a PDB file and return its ATOM/HETATM records as a list of lines."""
+    return PDB_Parser.read_atom_lines(pdb_file)
 
 def remove_ligands(pdb_lines):
     """Remove all HETATM records that are not water molecules (HOH)."""
-    return [line for line in pdb_lines if not (line.startswith("HETATM") and "HOH" not in line[17:20])]
+    return [line for line in pdb_lines if not is_ligand(line)]
 
 def remove_solvent(pdb_lines):
     """Remove solvent molecules (HOH)."""
-    return [line for line in pdb_lines if not (line.startswith("HETATM") and "HOH" in line[17:20])]
+    return [line for line in pdb_lines if not is_solvent(line)]
 
 def remove_hydrogens_and_renumber(pdb_lines):
     """Remove hydrogen atoms and renumber atom serial numbers."""
-    new_pdb = []
-    atom_number = 1
-    for line in pdb_lines:
-        if line.startswith("ATOM") or line.startswith("HETATM"):
-            if line[76:78].strip() != "H":  # Keep only non-hydrogen atoms
-                new_line = f"{line[:6]}{atom_number:5d}{line[11:]}"
-                new_pdb.append(new_line)
-                atom_number += 1
-        else:
-            new_pdb.append(line)
-    return new_pdb
-
-def keep_highest_occupancy(pdb_lines):
-    """Keep only the highest occupancy conformation for each atom, rename residues correctly, renumber atoms, and set occupancy to 1."""
-    atom_dict = {}
-    atom_number = 1  # Start atom numbering from 1
-    updated_pdb = []
-    
-    for line in pdb_lines:
-        if line.startswith("ATOM") or line.startswith("HETATM"):
-            atom_name = line[12:16].strip()
-            residue_name = line[17:20].strip()
-            alt_loc = line[16]  # Alternate location indicator
-            chain_id = line[21]
-            res_number = line[22:26].strip()
-            occupancy = float(line[54:60])
-            key = (atom_name, chain_id, res_number)
-            
-            if key not in atom_dict or occupancy > atom_dict[key][0]:
-                # Remove alternate location indicator, update residue name, renumber atom, and set occupancy to 1
-                updated_line = f"{line[:6]}{atom_number:5d}{line[11:16]} {residue_name}{line[20:54]}  1.00{line[60:]}"
-                atom_dict[key] = (occupancy, updated_line)
-                atom_number += 1  # Increment atom number sequentially
-    
-    return [atom_dict[key][1] for key in atom_dict]
+    return list(renumber_atoms(line for line in pdb_lines if is_atom_record(line) and not is_hydrogen(line)))
+
+def keep_highest_occupancy(pdb_lines, altloc=None):
+    """Keep only one conformation per residue (highest summed occupancy, or the given altloc ID), rename residues correctly, renumber atoms, and set occupancy to 1."""
+    return list(renumber_atoms(resolve_altlocs((line for line in pdb_lines if is_atom_record(line)), altloc)))
 
 def remove_non_atom_hetatm(pdb_lines):
     """Remove anything that is not an ATOM or HETATM record."""
-    return [line for line in pdb_lines if line.startswith("ATOM") or line.startswith("HETATM")]
+    return [line for line in pdb_lines if is_atom_record(line)]
 
 def remove_chains(pdb_lines, chains):
     """Remove specific chains from the PDB file."""
-    chains_to_remove = set(chains.split(","))
-    return [line for line in pdb_lines if line[21] not in chains_to_remove]
+    predicate = chain_predicate(chains)
+    return [line for line in pdb_lines if not predicate(line)]
 
 def remove_residues(pdb_lines, residues):
     """Remove specific residues with chain specification from the PDB file."""
-    residues_to_remove = set()
-    for entry in residues.split(","):
-        if "/" in entry:
-            chain, res_range = entry.split("/")
-            if "-" in res_range:
-                start, end = map(int, res_range.split("-"))
-                residues_to_remove.update((chain, str(res)) for res in range(start, end + 1))
-            else:
-                residues_to_remove.add((chain, res_range))
-        else:
-            try:
-                residues_to_remove.add((None, str(int(entry))))  # Ensure it's an integer
-            except ValueError:
-                print(f"Invalid residue specification: {entry}")
-                continue
-
-    return [line for line in pdb_lines if not ((line[21], line[22:26].strip()) in residues_to_remove or (None, line[22:26].strip()) in residues_to_remove or (line[21], line[22:26].strip()) in residues_to_remove)]
+    predicate = residue_predicate(residues)
+    return [line for line in pdb_lines if not predicate(line)]
 
 def renumber_pdb(pdb_lines):
     """Renumber residues sequentially from 1 per chain, ensuring ligands and solvent continue numbering from the last residue of their associated chain."""
-    new_pdb = []
-    residue_map = {}
-    current_resnum = {}
-    last_resnum = {}
-    prev_chain = None
-    prev_resnum = None
-    
-    for line in pdb_lines:
-        if line.startswith("ATOM") or line.startswith("HETATM"):
-            chain_id = line[21]
-            resnum = int(line[22:26].strip())
-            
-            # If it's a new chain and has not been seen before, start from 1
-            if chain_id not in current_resnum:
-                current_resnum[chain_id] = 1
-            
-            # If it's a known chain, continue from the last residue
-            elif chain_id in last_resnum:
-                current_resnum[chain_id] = last_resnum[chain_id] + 1
-            
-            # Assign a new residue number if we haven't seen this resnum before
-            if (chain_id, resnum) not in residue_map:
-                residue_map[(chain_id, resnum)] = current_resnum[chain_id]
-                current_resnum[chain_id] += 1
-                
-            last_resnum[chain_id] = residue_map[(chain_id, resnum)]  # Track last residue number
-            prev_chain = chain_id
-            prev_resnum = resnum
-            
-            # Modify the residue number in the line
-            new_line = line[:22] + f"{residue_map[(chain_id, resnum)]:4d}" + line[26:]
-            new_pdb.append(new_line)
-        else:
-            new_pdb.append(line)
-    
-    return new_pdb
-
-def process_pdb(input_pdb, output_pdb, options):
-    """Apply user-selected operations to clean the PDB file."""
-    pdb_lines = parse_pdb(input_pdb)
-
-    # Default cleanup (removes anything other than ATOM and HETATM)
-    pdb_lines = remove_non_atom_hetatm(pdb_lines)
-
+    return list(renumber_residues(line for line in pdb_lines if is_atom_record(line)))
+
+# ---------------------------------------------------------------------------
+# Fused single-pass pipeline
+# ---------------------------------------------------------------------------
+
+def option_value(options, flag):
+    """Return the value following a flag in the option list, or None."""
+    if flag in options:
+        index = options.index(flag) + 1
+        if index < len(options):
+            return options[index]
+    return None
+
+def build_pipeline(options):
+    """Translate command-line options into (removal predicates, rewriters) for one streaming pass."""
+    predicates = []
     if "--remove-solvent" in options:
-        pdb_lines = remove_solvent(pdb_lines)
+        predicates.append(is_solvent)
     if "--remove-ligands" in options:
-        pdb_lines = remove_ligands(pdb_lines)
+        predicates.append(is_ligand)
     if "--remove-hydrogens" in options:
-        pdb_lines = remove_hydrogens_and_renumber(pdb_lines)
+        predicates.append(is_hydrogen)
+    chains = option_value(options, "--remove-chains")
+    if chains is not None:
+        predicates.append(chain_predicate(chains))
+    residues = option_value(options, "--remove-residues")
+    if residues is not None:
+        predicates.append(residue_predicate(residues))
+
+    rewriters = []
+    selection = option_value(options, "--select")
+    if selection is not None:
+        rewriters.append(lambda records: select_records(records, selection))
+    removal = option_value(options, "--remove")
+    if removal is not None:
+        rewriters.append(lambda records: select_records(records, removal, keep=False))
     if "--keep-highest-occup" in options:
-        pdb_lines = keep_highest_occupancy(pdb_lines)
-    if "--remove-chains" in options:
-        chain_index = options.index("--remove-chains") + 1
-        if chain_index < len(options):
-            pdb_lines = remove_chains(pdb_lines, options[chain_index])
-    if "--remove-residues" in options:
-        res_index = options.index("--remove-residues") + 1
-        if res_index < len(options):
-            pdb_lines = remove_residues(pdb_lines, options[res_index])
+        altloc = option_value(options, "--altloc")
+        rewriters.append(lambda records: resolve_altlocs(records, altloc))
     if "--renumber" in options:
-        pdb_lines = renumber_pdb(pdb_lines)
+        rewriters.append(renumber_residues)
+    # atom serials are renumbered once, at output time
+    if ("--remove-hydrogens" in options or "--keep-highest-occup" in options
+            or selection is not None or removal is not None):
+        rewriters.append(renumber_atoms)
+    return predicates, rewriters
+
+def process_records(lines, options):
+    """Stream PDB lines through every enabled filter and rewriter in a single pass."""
+    predicates, rewriters = build_pipeline(options)
+    # Default cleanup (removes anything other than ATOM and HETATM)
+    records = (line for line in lines if is_atom_record(line)
+               and not any(predicate(line) for predicate in predicates))
+    for rewriter in rewriters:
+        records = rewriter(records)
+    return records
 
-    with open(output_pdb, 'w') as file:
-        file.writelines(pdb_lines)
+def process_pdb(input_pdb, output_pdb, options):
+    """Apply user-selected operations to clean the PDB file, streaming records straight to the output."""
+    if PDB_Parser.is_cif_file(output_pdb):
+        raise ValueError("mmCIF output is not supported; write a .pdb file")
+    if PDB_Parser.is_cif_file(input_pdb):
+        process_cif(input_pdb, output_pdb, options)
+        return
+    with PDB_Parser.open_pdb(input_pdb) as infile, PDB_Parser.open_pdb(output_pdb, 'w') as outfile:
+        outfile.writelines(process_records(infile, options))
+
+def process_cif(input_cif, output_pdb, options):
+    """Convert an mmCIF file to PDB records model by model and process each model (see process_pdb)."""
+    structure = PDB_Parser.read_structure(input_cif)
+    # checked before the output is opened, so a structure beyond the PDB limits leaves no file
+    chain_map = PDB_Parser.pdb_chain_map(structure)
+    structure = PDB_Parser.remap_chains(structure, chain_map)
+    PDB_Parser.check_pdb_limits(structure)
+    for long_chain, chain in chain_map.items():
+        print(f"Note: chain {long_chain} of {input_cif} is written as chain {chain}")
+
+    models = list(CIF_Parser.iter_cif_models(structure))
+    with PDB_Parser.open_pdb(output_pdb, 'w') as outfile:
+        for model in models:
+            if len(models) > 1:
+                outfile.write(f"MODEL     {int(model.model[0]):4d}\n")
+            outfile.writelines(process_records(PDB_Parser.format_atom_lines(model), options))
+            if len(models) > 1:
+                outfile.write("ENDMDL\n")
+
+# ---------------------------------------------------------------------------
+# Batch mode
+# ---------------------------------------------------------------------------
+
+def collect_inputs(source):
+    """Expand a directory, glob pattern or file list (one path per line) into a sorted list of PDB paths."""
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, f) for f in os.listdir(source) if PDB_Parser.is_structure_file(f))
+    if os.path.isfile(source) and not PDB_Parser.is_structure_file(source):
+        with open(source, 'r') as file_list:
+            return [line.strip() for line in file_list if line.strip()]
+    return sorted(glob.glob(source))
+
+def process_task(paths, options):
+    """Process one (input, output) pair; returns an error message or None (worker entry point)."""
+    input_pdb, output_pdb = paths
+    try:
+        process_pdb(input_pdb, output_pdb, options)
+        return None
+    except Exception as e:
+        if os.path.exists(output_pdb):  # do not leave a partially written file behind
+            os.remove(output_pdb)
+        return f"{type(e).__name__}: {e}"
+
+def output_name(input_pdb, output_dir, compression=None):
+    """Batch output path: the input file name in output_dir, recompressed if `compression` is given."""
+    output_pdb = os.path.join(output_dir, os.path.basename(input_pdb))
+    if PDB_Parser.is_cif_file(input_pdb):  # converted to PDB format, keeping the compression of the input
+        suffix = os.path.splitext(input_pdb)[1] if PDB_Parser.compression_module(input_pdb) else ""
+        output_pdb = os.path.join(output_dir, PDB_Parser.structure_stem(input_pdb) + ".pdb" + suffix)
+    if compression is None:
+        return output_pdb
+    return PDB_Parser.with_compression(output_pdb, None if compression == "none" else compression)
+
+def process_batch(source, output_dir, options, jobs=1):
+    """Apply the same options to every input PDB, writing into output_dir; returns the list of failures."""
+    compression = option_value(options, "--compress")
+    if compression is not None:
+        try:
+            PDB_Parser.with_compression("", None if compression == "none" else compression)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    inputs = collect_inputs(source)
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(path, output_name(path, output_dir, compression)) for path in inputs]
+    outputs = [output_pdb for _, output_pdb in tasks]
+    if len(set(outputs)) < len(outputs):
+        duplicate = next(output_pdb for output_pdb in outputs if outputs.count(output_pdb) > 1)
+        print(f"Error: several inputs would be written to {duplicate}.")
+        sys.exit(1)
+
+    failures = []
+    for (input_pdb, _), error in zip(tasks, Parallel.imap_ordered(partial(process_task, options=options), tasks, jobs=jobs)):
+        if error is None:
+            print(f"OK:     {input_pdb}")
+        else:
+            print(f"FAILED: {input_pdb} ({error})")
+            failures.append((input_pdb, error))
+
+    print(f"Processed {len(tasks)} files: {len(tasks) - len(failures)} succeeded, {len(failures)} failed.")
+    return failures
 
 if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "--batch":
+        if len(sys.argv) < 4:
+            print("Usage: python Process_PDB.py --batch <input_dir | glob | file_list> <output_dir> [options] [--jobs N]")
+            sys.exit(1)
+        options = Parallel.strip_jobs_option(sys.argv[4:])
+        failures = process_batch(sys.argv[2], sys.argv[3], options, Parallel.jobs_from_options(sys.argv))
+        sys.exit(1 if failures else 0)
+
     if len(sys.argv) < 3:
         print("Usage: python Process_PDB.py <input_pdb> <output_pdb> [options]")
         sys.exit(1)
@@ -260,5 +563,8 @@ if __name__ == "__main__":
     output_pdb = sys.argv[2]
     options = sys.argv[3:]
 
-    process_pdb(input_pdb, output_pdb, options)
-
+    try:
+        process_pdb(input_pdb, output_pdb, options)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
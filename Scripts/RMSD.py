@@ -7,13 +7,35 @@ or PDB format using transformation and rotation.
 Supports both **all-atom RMSD** and **backbone RMSD (N, CA, C, O)**.
 
 Usage:
-    python RMSD.py <structure_A.pdb> <structure_B.pdb> [--backbone]
+    python RMSD.py <structure_A.pdb> <structure_B.pdb> [--backbone] [--models] [--match <mode>] [--reorder <mode>] [--select "<expr>"]
 
 Arguments:
     structure_A.pdb : First PDB file (reference structure)
     structure_B.pdb : Second PDB file (target structure)
     --backbone      : Optional flag to compute RMSD for backbone atoms only.
                       If omitted, computes all-atom RMSD.
+    --models        : Optional flag to treat structure_B as a multi-model
+                      (NMR/MD) PDB file or a coordinate store (Coord_Store.py)
+                      and report the RMSD of every MODEL against structure_A,
+                      streaming one model at a time.
+    --match <mode>  : Pair atoms by (chain, residue number, insertion code,
+                      atom name) instead of by file order (see Atom_Matching.py):
+                      strict, intersection (atoms present in both) or align
+                      (residues paired by sequence alignment).
+    --reorder <mode>: Optional atom reordering before the RMSD:
+                      symmetry  - swap symmetry-equivalent atoms (PHE/TYR ring
+                                  flips, ASP/GLU carboxylates, ARG guanidinium)
+                                  when that lowers the RMSD
+                      hungarian - ignore atom names and pair atoms of the same
+                                  element by minimal distance (Hungarian
+                                  algorithm), trying all 48 axis swaps and
+                                  reflections; includes HETATM records (except
+                                  water), for ligand RMSD. Requires SciPy,
+                                  imported only in this mode. Atom names are
+                                  ignored, so it cannot be combined with --match.
+    --select <expr> : Compare only the atoms matching an Atom_Selection.py
+                      expression, e.g. "backbone and chain A" or
+                      "protein and not hydrogen" (replaces --backbone).
 
 Modified version of the RMSD calculation script.
 
@@ -54,12 +76,26 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 
-import copy
-import re
 import sys
 import numpy as np
-from scipy.optimize import linear_sum_assignment
-from scipy.spatial.distance import cdist
+import PDB_Parser
+import Coord_Store
+import Atom_Matching
+import Atom_Selection
+
+
+REORDER_MODES = ("symmetry", "hungarian")
+
+# pairs of atoms that are interchangeable by symmetry; all pairs of a residue are swapped together
+SYMMETRIC_ATOMS = {
+    "PHE": (("CD1", "CD2"), ("CE1", "CE2")),
+    "TYR": (("CD1", "CD2"), ("CE1", "CE2")),
+    "ASP": (("OD1", "OD2"),),
+    "GLU": (("OE1", "OE2"),),
+    "ARG": (("NH1", "NH2"),),
+}
+# maximum number of superpose/reassign rounds when reordering
+REORDER_ITERATIONS = 10
 
 
 AXIS_SWAPS = np.array([
@@ -83,17 +119,50 @@ AXIS_REFLECTIONS = np.array([
 ])
 
 
-def parse_pdb(filename, backbone_only=False):
-    """Extract atomic coordinates from a PDB file. Optionally filters for backbone atoms."""
-    atoms = []
-    with open(filename, 'r') as file:
-        for line in file:
-            if line.startswith("ATOM"):
-                atom_name = line[12:16].strip()
-                if not backbone_only or atom_name in ["N", "CA", "C", "O"]:
-                    x, y, z = map(float, [line[30:38], line[38:46], line[46:54]])
-                    atoms.append([x, y, z])
-    return np.array(atoms)
+def selection_mask(structure, backbone_only=False, hetero=False, selection=None):
+    """Mask of the atoms to compare: a selection expression (see Atom_Selection.py) if given, else the
+    backbone atoms, the ATOM records, or (hetero=True) everything but water."""
+    if selection is None:
+        selection = "backbone" if backbone_only else ("not water" if hetero else "not hetero")
+    return Atom_Selection.compile_selection(selection).mask(structure)
+
+
+def select_atoms(structure, backbone_only=False, hetero=False, selection=None):
+    """Restrict a parsed structure to the atoms selected by selection_mask."""
+    return structure.select(selection_mask(structure, backbone_only, hetero, selection))
+
+
+def parse_structure(filename, backbone_only=False, hetero=False, selection=None):
+    """Read a PDB file and return the selected atoms as a Structure (keeps residue and atom identities)."""
+    return select_atoms(PDB_Parser.read_structure(filename), backbone_only, hetero, selection)
+
+
+def parse_pdb(filename, backbone_only=False, selection=None):
+    """Extract atomic coordinates (ATOM records) from a PDB file. Optionally filters for backbone atoms or a selection."""
+    return parse_structure(filename, backbone_only, selection=selection).coords.astype(np.float64)
+
+
+def parse_model_structures(filename, backbone_only=False, hetero=False, selection=None):
+    """Yield (model_number, Structure) with the selected atoms of each MODEL of a multi-model PDB file or store."""
+    if Coord_Store.is_store(filename):
+        store = Coord_Store.open_store(filename)
+        mask = selection_mask(store.topology, backbone_only, hetero, selection)
+        selected = store.topology.select(mask)
+        for index in range(len(store)):
+            structure = selected.select(slice(None))
+            structure.coords = np.asarray(store.coords[index][mask])
+            yield index + 1, structure
+        return
+    for structure in PDB_Parser.iter_models(filename):
+        yield int(structure.model[0]), select_atoms(structure, backbone_only, hetero, selection)
+
+
+def parse_models(filename, backbone_only=False, selection=None):
+    """Yield the atomic coordinates (ATOM records) of each MODEL of a multi-model PDB file as (model_number, coords).
+
+    A coordinate store (see Coord_Store.py) is read directly; models are numbered from 1."""
+    for model_number, structure in parse_model_structures(filename, backbone_only, selection=selection):
+        yield model_number, structure.coords.astype(np.float64)
 
 
 def rmsd(V, W):
@@ -101,42 +170,284 @@ def rmsd(V, W):
     return np.sqrt(((V - W) ** 2).sum() / len(V))
 
 
-def kabsch_rmsd(P, Q):
-    """Apply Kabsch algorithm for optimal alignment and compute RMSD."""
-    P = P - np.mean(P, axis=0)
-    Q = Q - np.mean(Q, axis=0)
+def kabsch_rotation(P, Q):
+    """Optimal rotation matrix R (Kabsch algorithm) so that P @ R best fits Q, for centered P and Q."""
     H = P.T @ Q
     U, _, Vt = np.linalg.svd(H)
     R = U @ Vt
     if np.linalg.det(R) < 0:
         Vt[-1, :] *= -1
         R = U @ Vt
-    P = P @ R
+    return R
+
+
+def kabsch_rmsd(P, Q):
+    """Apply Kabsch algorithm for optimal alignment and compute RMSD."""
+    P = P - np.mean(P, axis=0)
+    Q = Q - np.mean(Q, axis=0)
+    P = P @ kabsch_rotation(P, Q)
     return rmsd(P, Q)
 
 
-def main(structure_A, structure_B, backbone_only=False):
-    """Compute RMSD between two PDB structures using the original algorithm."""
-    coords_A = parse_pdb(structure_A, backbone_only=backbone_only)
-    coords_B = parse_pdb(structure_B, backbone_only=backbone_only)
-   
+def center(coords):
+    """Translate each coordinate set (last two axes: atoms x 3) to its centroid."""
+    coords = np.asarray(coords, dtype=np.float64)
+    return coords - coords.mean(axis=-2, keepdims=True)
 
-    if len(coords_A) != len(coords_B):
-        print("Error: Structures have different numbers of selected atoms.")
-        sys.exit(1)
-    
+
+def rmsd_from_covariance(H, norm_P, norm_Q, n_atoms):
+    """Kabsch RMSD from stacked 3x3 covariance matrices of centered coordinates.
+
+    Uses RMSD^2 = (|P|^2 + |Q|^2 - 2 * (s1 + s2 + d * s3)) / N, where s are the
+    singular values of H and d corrects for reflections, so no rotation matrix
+    has to be built. One batched SVD is run over the whole stack."""
+    S = np.linalg.svd(H, compute_uv=False)
+    S[..., -1] *= np.where(np.linalg.det(H) < 0, -1.0, 1.0)
+    msd = (norm_P + norm_Q - 2.0 * S.sum(axis=-1)) / n_atoms
+    return np.sqrt(np.maximum(msd, 0.0))
+
+
+def kabsch_rmsd_batch(P, Q):
+    """Kabsch RMSD for stacks of coordinate sets, aligned element-wise.
+
+    P and Q are (..., N, 3) arrays that broadcast against each other, e.g. an
+    ensemble (M, N, 3) against a single reference (N, 3)."""
+    P = center(P)
+    Q = center(Q)
+    H = np.einsum('...ni,...nj->...ij', P, Q)
+    return rmsd_from_covariance(H, (P ** 2).sum(axis=(-2, -1)), (Q ** 2).sum(axis=(-2, -1)), P.shape[-2])
+
+
+def cross_rmsd(P, Q):
+    """Return the (A, B) Kabsch RMSD matrix between two stacks of centered coordinates (A, N, 3) and (B, N, 3).
+
+    All A x B covariance matrices come from a single matrix product."""
+    n_A, n_atoms, _ = P.shape
+    n_B = len(Q)
+    # (N, M*3) layout so that P_i^T Q_j for every i, j is one GEMM
+    P_flat = P.transpose(1, 0, 2).reshape(n_atoms, n_A * 3)
+    Q_flat = Q.transpose(1, 0, 2).reshape(n_atoms, n_B * 3)
+    H = (P_flat.T @ Q_flat).reshape(n_A, 3, n_B, 3).transpose(0, 2, 1, 3)
+    norm_P = (P ** 2).sum(axis=(1, 2))
+    norm_Q = (Q ** 2).sum(axis=(1, 2))
+    return rmsd_from_covariance(H, norm_P[:, None], norm_Q[None, :], n_atoms)
+
+
+def pairwise_rmsd(coords, block_size=256, jobs=1):
+    """Return the full (M, M) Kabsch RMSD matrix for a stacked (M, N, 3) coordinate array.
+
+    Only the upper triangle is evaluated, in tiles of `block_size` models spread
+    over `jobs` processes, and then mirrored (see Pairwise_RMSD.pairwise_rmsd)."""
+    import Pairwise_RMSD  # imported here: Pairwise_RMSD builds on this module
+    return Pairwise_RMSD.pairwise_rmsd(coords, jobs=jobs, block_size=block_size)
+
+
+def symmetric_groups(structure):
+    """Index arrays of symmetry-equivalent atom pairs, one (residues, pairs, 2) array per residue type."""
+    groups = []
+    residue_ids = Atom_Matching.residue_labels(structure)
+    for resname, pairs in SYMMETRIC_ATOMS.items():
+        in_residue = structure.resname == resname
+        if not in_residue.any():
+            continue
+        names = [name for pair in pairs for name in pair]
+        atoms = np.flatnonzero(in_residue & np.isin(structure.name, names))
+        residues, position = np.unique(residue_ids[atoms], return_inverse=True)
+        index = np.full((len(residues), len(names)), -1, dtype=np.int64)
+        index[position, [names.index(name) for name in structure.name[atoms]]] = atoms
+        complete = (index >= 0).all(axis=1)  # skip residues with missing side-chain atoms
+        if complete.any():
+            groups.append(index[complete].reshape(-1, len(pairs), 2))
+    return groups
+
+
+def swap_symmetric_atoms(coords_A, coords_B, groups):
+    """Return an atom order for coords_B with symmetry-equivalent atoms swapped where that fits coords_A better.
+
+    Superposition and swaps alternate until no residue changes."""
+    order = np.arange(len(coords_B))
+    A = coords_A - coords_A.mean(axis=0)
+    for _ in range(REORDER_ITERATIONS):
+        B = coords_B[order] - coords_B[order].mean(axis=0)
+        B = B @ kabsch_rotation(B, A)
+        changed = False
+        for index in groups:
+            first, second = index[..., 0], index[..., 1]
+            keep = ((A[first] - B[first]) ** 2).sum(axis=(1, 2)) + ((A[second] - B[second]) ** 2).sum(axis=(1, 2))
+            swap = ((A[first] - B[second]) ** 2).sum(axis=(1, 2)) + ((A[second] - B[first]) ** 2).sum(axis=(1, 2))
+            flip = swap < keep - 1e-9
+            if flip.any():
+                order[first[flip]], order[second[flip]] = order[second[flip]], order[first[flip]]
+                changed = True
+        if not changed:
+            break
+    return order
+
+
+def reorder_hungarian(elements_A, elements_B, coords_A, coords_B):
+    """Pair the atoms of each element by minimal total distance; returns an order so coords_B[order] matches coords_A."""
+    from scipy.optimize import linear_sum_assignment
+    from scipy.spatial.distance import cdist
+
+    if len(coords_A) != len(coords_B) or not np.array_equal(np.sort(elements_A), np.sort(elements_B)):
+        raise Atom_Matching.MatchError("Structures do not contain the same atoms of each element.")
+    order = np.empty(len(coords_B), dtype=np.int64)
+    for element in np.unique(elements_A):
+        index_A = np.flatnonzero(elements_A == element)
+        index_B = np.flatnonzero(elements_B == element)
+        rows, cols = linear_sum_assignment(cdist(coords_A[index_A], coords_B[index_B]))
+        order[index_A[rows]] = index_B[cols]
+    return order
+
+
+def reorder_axis_swaps(elements_A, elements_B, coords_A, coords_B):
+    """Hungarian reordering robust to the initial orientation.
+
+    The assignment is tried for every axis swap and reflection of the centered
+    coordinates; the best one is refined by alternating superposition and
+    reassignment until it no longer improves."""
+    A = center(coords_A)
+    B = center(coords_B)
+    best_rmsd, best_order = np.inf, None
+    for swap in AXIS_SWAPS:
+        for reflection in AXIS_REFLECTIONS:
+            order = reorder_hungarian(elements_A, elements_B, A, B[:, swap] * reflection)
+            value = kabsch_rmsd(B[order], A)
+            if value < best_rmsd:
+                best_rmsd, best_order = value, order
+
+    for _ in range(REORDER_ITERATIONS):
+        rotated = B @ kabsch_rotation(B[best_order], A)
+        order = reorder_hungarian(elements_A, elements_B, A, rotated)
+        value = kabsch_rmsd(B[order], A)
+        if value >= best_rmsd - 1e-9:
+            break
+        best_rmsd, best_order = value, order
+    return best_order
+
+
+def matched_coords(mapper, structure_A, structure_B):
+    """Coordinates of corresponding atoms: matched by identity with an AtomMapper, or by file order without one."""
+    if mapper is not None:
+        coords_A, coords_B = mapper.pair(structure_B)
+        return coords_A.astype(np.float64), coords_B.astype(np.float64)
+    if len(structure_A) != len(structure_B):
+        raise Atom_Matching.MatchError("Structures have different numbers of selected atoms.")
+    return structure_A.coords.astype(np.float64), structure_B.coords.astype(np.float64)
+
+
+class Comparison:
+    """Reference structure plus the matching and reordering settings applied to every compared structure."""
+
+    def __init__(self, reference, match=None, reorder=None):
+        self.reference = reference
+        self.reorder = reorder
+        self.mapper = Atom_Matching.AtomMapper(reference, match) if match else None
+        if reorder == "symmetry":
+            # computed once, in reference atom order (matched coordinates follow the reference order)
+            present = self.mapper.lookup(reference) >= 0 if self.mapper else slice(None)
+            self.groups = symmetric_groups(reference.select(present))
+
+    def coords(self, structure):
+        """Corresponding (reference_coords, structure_coords) after matching and reordering."""
+        if self.reorder == "hungarian":
+            order = reorder_axis_swaps(self.reference.element, structure.element,
+                                       self.reference.coords.astype(np.float64), structure.coords.astype(np.float64))
+            return self.reference.coords.astype(np.float64), structure.coords[order].astype(np.float64)
+        coords_A, coords_B = matched_coords(self.mapper, self.reference, structure)
+        if self.reorder == "symmetry" and self.groups:
+            if self.mapper is not None and len(coords_A) != len(self.reference):
+                # atoms missing in this structure shift the indices; recompute the groups for the matched subset
+                groups = symmetric_groups(self.reference.select(self.mapper.lookup(structure) >= 0))
+            else:
+                groups = self.groups
+            coords_B = coords_B[swap_symmetric_atoms(coords_A, coords_B, groups)]
+        return coords_A, coords_B
+
+    def rmsd(self, structure):
+        """Kabsch RMSD of a structure against the reference; raises Atom_Matching.MatchError if they cannot be paired."""
+        coords_A, coords_B = self.coords(structure)
+        return kabsch_rmsd(coords_B, coords_A)
+
+
+def main(structure_A, structure_B, backbone_only=False, match=None, reorder=None, selection=None):
+    """Compute RMSD between two PDB structures using the original algorithm.
+
+    With `match` (see Atom_Matching.MATCH_MODES) atoms are paired by residue and
+    atom name instead of file order; `reorder` (see REORDER_MODES) swaps
+    symmetric atoms or reassigns atoms by element; `selection` is an
+    Atom_Selection expression replacing the default atom choice. Raises
+    Atom_Matching.MatchError when the structures cannot be matched."""
+    hetero = reorder == "hungarian"
+    comparison = Comparison(parse_structure(structure_A, backbone_only, hetero, selection), match, reorder)
+    coords_A, coords_B = comparison.coords(parse_structure(structure_B, backbone_only, hetero, selection))
     return kabsch_rmsd(coords_A, coords_B)
 
 
+def main_models(structure_A, structure_B, backbone_only=False, match=None, reorder=None, selection=None):
+    """Yield (model_number, RMSD) for every MODEL of structure_B against structure_A.
+
+    The atom mapping is computed once per model topology. A model that cannot
+    be matched yields (model_number, None) and a warning instead of stopping."""
+    hetero = reorder == "hungarian"
+    comparison = Comparison(parse_structure(structure_A, backbone_only, hetero, selection), match, reorder)
+    for model_number, structure in parse_model_structures(structure_B, backbone_only, hetero, selection):
+        try:
+            result = comparison.rmsd(structure)
+        except Atom_Matching.MatchError as e:
+            print(f"Warning: Model {model_number} skipped: {e}")
+            yield model_number, None
+            continue
+        yield model_number, result
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("Usage: python RMSD.py <structure_A.pdb> <structure_B.pdb> [--backbone]")
+        print("Usage: python RMSD.py <structure_A.pdb> <structure_B.pdb> [--backbone] [--models] [--match <mode>] [--reorder <mode>] [--select \"<expr>\"]")
         sys.exit(1)
     
     structure_A = sys.argv[1]
     structure_B = sys.argv[2]
     backbone_only = "--backbone" in sys.argv
+    label = 'Backbone' if backbone_only else 'All-atom'
+    selection = None
+    if "--select" in sys.argv:
+        select_index = sys.argv.index("--select") + 1
+        selection = sys.argv[select_index] if select_index < len(sys.argv) else ""
+        try:
+            Atom_Selection.compile_selection(selection)
+        except Atom_Selection.SelectionError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        label = 'Selection'
+    match = None
+    if "--match" in sys.argv:
+        match_index = sys.argv.index("--match") + 1
+        match = sys.argv[match_index] if match_index < len(sys.argv) else None
+        if match not in Atom_Matching.MATCH_MODES:
+            print(f"Error: --match expects one of: {', '.join(Atom_Matching.MATCH_MODES)}")
+            sys.exit(1)
+    reorder = None
+    if "--reorder" in sys.argv:
+        reorder_index = sys.argv.index("--reorder") + 1
+        reorder = sys.argv[reorder_index] if reorder_index < len(sys.argv) else None
+        if reorder not in REORDER_MODES:
+            print(f"Error: --reorder expects one of: {', '.join(REORDER_MODES)}")
+            sys.exit(1)
+    
+    if reorder == "hungarian" and match:
+        print("Error: --match cannot be combined with --reorder hungarian (which ignores atom names).")
+        sys.exit(1)
     
-    result = main(structure_A, structure_B, backbone_only)
-    print(f"{'Backbone' if backbone_only else 'All-atom'} RMSD: {result:.3f} Å")
+    if "--models" in sys.argv:
+        for model_number, result in main_models(structure_A, structure_B, backbone_only, match, reorder, selection):
+            if result is not None:
+                print(f"Model {model_number} {label} RMSD: {result:.3f} Å")
+    else:
+        try:
+            result = main(structure_A, structure_B, backbone_only, match, reorder, selection)
+        except Atom_Matching.MatchError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"{label} RMSD: {result:.3f} Å")
 
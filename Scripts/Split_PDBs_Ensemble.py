@@ -8,13 +8,30 @@ Author: Niayesh Zarifi
 This script processes a multi-template PDB file containing an ensemble of structures
 and extracts each member into a separate PDB file.
 
+The input is streamed: each model is written to disk as soon as its ENDMDL record
+is read, so memory use stays small and constant even for multi-GB ensembles.
+Compressed inputs (.pdb.gz, .pdb.bz2, .pdb.xz) are decompressed on the fly, and the
+models can be written compressed with `--compress`. mmCIF inputs (.cif, .cif.gz) are
+split by model number and each model is written in PDB format: chain IDs longer than
+one character are replaced by unused single-character IDs (the same in every model; the
+mapping is printed) and residue numbers above 9999 are written in hybrid-36.
+
 Usage:
 ------
-    python Split_PDBs_Ensemble.py <input_pdb>
+    python Split_PDBs_Ensemble.py <input_pdb> [options]
+
+Options:
+--------
+    --output-dir <dir>     Directory for the extracted models (default: current directory)
+    --models <list>        Only extract these MODEL numbers (e.g., 1,5,10-20)
+    --stride <N>           Only extract every Nth model in the file (e.g., 10 keeps the 1st, 11th, 21st, ...)
+    --compress <type>      Write the models compressed with gz, bz2 or xz (e.g., ensemble_1.pdb.gz)
 
 Example:
 --------
     python Split_PDBs_Ensemble.py ensemble.pdb
+    python Split_PDBs_Ensemble.py trajectory.pdb --output-dir frames --stride 10
+    python Split_PDBs_Ensemble.py trajectory.pdb.gz --output-dir frames --compress gz
 
 Outputs:
 --------
@@ -24,50 +41,127 @@ Outputs:
 
 import sys
 import os
-
-def read_pdb_file(file_path):
-    """Reads a PDB file and returns its contents as a list of lines."""
-    with open(file_path, 'r') as pdb_file:
-        return pdb_file.readlines()
-
-def split_ensemble_to_models(pdb_lines):
-    """Splits the input PDB lines into separate models and stores them in a dictionary."""
-    models = {}
-    current_model = None
-
-    for line in pdb_lines:
-        if line.startswith("MODEL"):
-            current_model = int(line.split()[1])
-            models[current_model] = [line]
-        elif line.startswith("ENDMDL"):
-            if current_model is not None:
-                models[current_model].append(line)
-                current_model = None
-        elif current_model is not None:
-            models[current_model].append(line)
-
+import PDB_Parser
+import CIF_Parser
+
+def parse_model_selection(selection):
+    """Parse a model selection such as '1,5,10-20' into a set of model numbers."""
+    models = set()
+    for entry in selection.split(","):
+        if "-" in entry:
+            start, end = map(int, entry.split("-"))
+            models.update(range(start, end + 1))
+        elif entry:
+            models.add(int(entry))
     return models
 
-def write_individual_models(models, input_filename):
-    """Writes each extracted model to its own PDB file, using input filename as prefix."""
-    base_name = os.path.splitext(os.path.basename(input_filename))[0]  # Remove .pdb extension
-
-    for model_id, model_lines in models.items():
-        output_filename = f"{base_name}_{model_id}.pdb"
-        with open(output_filename, 'w') as output_file:
-            output_file.writelines(model_lines)
+def split_ensemble(input_pdb, output_dir=".", models=None, stride=1, compression=None):
+    """Stream the input PDB and write each selected model to its own PDB file as soon as it is complete.
+
+    Models are selected by MODEL number (`models`, a set or None for all) and by
+    position in the file (`stride`); `compression` ('gz', 'bz2', 'xz' or None)
+    compresses the written files. Returns the list of written files."""
+    base_name = PDB_Parser.structure_stem(input_pdb)  # Remove .pdb (and .gz, ...) extension
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    output_file = None
+    model_index = 0
+
+    if PDB_Parser.is_cif_file(input_pdb):
+        return split_cif_ensemble(input_pdb, output_dir, models, stride, compression)
+
+    with PDB_Parser.open_pdb(input_pdb) as pdb_file:
+        for line in pdb_file:
+            if line.startswith("MODEL"):
+                model_id = int(line.split()[1])
+                keep = model_index % stride == 0 and (models is None or model_id in models)
+                model_index += 1
+                if keep:
+                    output_filename = PDB_Parser.with_compression(
+                        os.path.normpath(os.path.join(output_dir, f"{base_name}_{model_id}.pdb")), compression)
+                    output_file = PDB_Parser.open_pdb(output_filename, 'w')
+                    output_file.write(line)
+            elif output_file is not None:
+                output_file.write(line)
+                if line.startswith("ENDMDL"):
+                    output_file.close()
+                    output_file = None
+                    written.append(output_filename)
+                    print(f"Saved: {output_filename}")
+
+    if output_file is not None:  # truncated file without a final ENDMDL
+        output_file.close()
+        written.append(output_filename)
         print(f"Saved: {output_filename}")
+    return written
+
+def split_cif_ensemble(input_cif, output_dir=".", models=None, stride=1, compression=None):
+    """Write each selected model of an mmCIF file to its own PDB file (see split_ensemble)."""
+    base_name = PDB_Parser.structure_stem(input_cif)
+    ensemble = PDB_Parser.read_structure(input_cif)
+    # one chain map for the whole file, so that every model uses the same chain IDs
+    chain_map = PDB_Parser.pdb_chain_map(ensemble)
+    ensemble = PDB_Parser.remap_chains(ensemble, chain_map)
+    PDB_Parser.check_pdb_limits(ensemble)
+    for long_chain, chain in chain_map.items():
+        print(f"Note: chain {long_chain} is written as chain {chain}")
+    written = []
+    for model_index, structure in enumerate(CIF_Parser.iter_cif_models(ensemble)):
+        model_id = int(structure.model[0])
+        if model_index % stride != 0 or (models is not None and model_id not in models):
+            continue
+        lines = PDB_Parser.format_atom_lines(structure)
+        output_filename = PDB_Parser.with_compression(
+            os.path.normpath(os.path.join(output_dir, f"{base_name}_{model_id}.pdb")), compression)
+        with PDB_Parser.open_pdb(output_filename, 'w') as output_file:
+            output_file.write(f"MODEL     {model_id:4d}\n")
+            output_file.writelines(lines)
+            output_file.write("ENDMDL\n")
+        written.append(output_filename)
+        print(f"Saved: {output_filename}")
+    return written
 
 def main():
     """Main function to process the input PDB file and split its ensemble."""
-    if len(sys.argv) != 2:
-        print("Usage: python Split_PDBs_Ensemble.py <input_pdb>")
+    if len(sys.argv) < 2:
+        print("Usage: python Split_PDBs_Ensemble.py <input_pdb> [--output-dir <dir>] [--models <list>] [--stride <N>] "
+              "[--compress <gz|bz2|xz>]")
         sys.exit(1)
 
     input_pdb = sys.argv[1]
-    pdb_lines = read_pdb_file(input_pdb)
-    models = split_ensemble_to_models(pdb_lines)
-    write_individual_models(models, input_pdb)
+    options = sys.argv[2:]
+
+    output_dir = "."
+    if "--output-dir" in options:
+        dir_index = options.index("--output-dir") + 1
+        if dir_index < len(options):
+            output_dir = options[dir_index]
+    models = None
+    if "--models" in options:
+        models_index = options.index("--models") + 1
+        if models_index < len(options):
+            models = parse_model_selection(options[models_index])
+    stride = 1
+    if "--stride" in options:
+        stride_index = options.index("--stride") + 1
+        if stride_index < len(options):
+            stride = max(int(options[stride_index]), 1)
+    compression = None
+    if "--compress" in options:
+        compress_index = options.index("--compress") + 1
+        if compress_index < len(options):
+            compression = options[compress_index]
+        try:
+            PDB_Parser.with_compression("", compression)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+
+    try:
+        split_ensemble(input_pdb, output_dir, models, stride, compression)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+Parsed Structure Cache
+======================
+On-disk cache of parsed structures shared by every script that reads PDB files
+through PDB_Parser (RMSD, deviation/diversity, AlphaFold analysis, pi-stacking).
+
+Each entry is a single `.npy` file holding the parsed columns as one structured
+array, which loads with one read instead of re-parsing text. Entries are
+keyed by the absolute path, modification time and size of the source file, so
+an edited file is parsed again automatically, and by CACHE_VERSION, so entries
+written by an older parser are never returned. The cache is bounded in size:
+each process keeps a running total of the cache size and, as soon as a new
+entry takes it over the bound, the least recently used entries are evicted.
+
+The cache is off by default. Enable it with environment variables (inherited by
+worker processes):
+
+    export PDB_CACHE_DIR=/scratch/pdb_cache   # cache directory
+    export PDB_CACHE_MAX_MB=20480             # optional size bound (default: 10240)
+
+or from Python with `Structure_Cache.configure(cache_dir, max_mb)`.
+"""
+
+import hashlib
+import os
+import numpy as np
+
+
+DEFAULT_MAX_MB = 10240
+# part of every entry key: bump whenever PDB_Parser/CIF_Parser parse a file into different columns
+CACHE_VERSION = 2
+# rescan the cache directory after this many new entries, to count the entries
+# written by other processes into the running total
+RESCAN_INTERVAL = 256
+
+_cache = None
+
+
+class StructureCache:
+    """Size-bounded LRU cache of structured arrays keyed by source file identity."""
+
+    def __init__(self, cache_dir, max_mb=DEFAULT_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self.total_bytes = None  # scanned on the first store
+        self.stores_since_scan = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_path(self, filename):
+        """Cache file for the current version of a source file."""
+        stat = os.stat(filename)
+        key = f"{CACHE_VERSION}|{os.path.abspath(filename)}|{stat.st_mtime_ns}|{stat.st_size}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".npy")
+
+    def load(self, filename):
+        """Return the cached structured array for a file, or None on a miss."""
+        path = self.entry_path(filename)
+        try:
+            records = np.load(path, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)  # mark as recently used
+        return records
+
+    def store(self, filename, records):
+        """Save a structured array for a file; written atomically so concurrent workers never see partial entries."""
+        path = self.entry_path(filename)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as file:
+            np.save(file, records, allow_pickle=False)
+        size = os.path.getsize(temporary)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(temporary, path)
+
+        self.stores_since_scan += 1
+        if self.total_bytes is None or self.stores_since_scan >= RESCAN_INTERVAL:
+            self.evict()
+        else:
+            self.total_bytes += size - replaced
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Rescan the cache and delete least recently used entries until it fits its size bound."""
+        self.stores_since_scan = 0
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self.total_bytes = total
+
+
+def configure(cache_dir, max_mb=DEFAULT_MAX_MB):
+    """Enable the cache for this process (pass None to disable it)."""
+    global _cache
+    _cache = StructureCache(cache_dir, max_mb) if cache_dir else None
+    return _cache
+
+
+def default_cache():
+    """Return the active cache, creating it from PDB_CACHE_DIR / PDB_CACHE_MAX_MB on first use."""
+    global _cache
+    if _cache is None and os.environ.get("PDB_CACHE_DIR"):
+        configure(os.environ["PDB_CACHE_DIR"], float(os.environ.get("PDB_CACHE_MAX_MB", DEFAULT_MAX_MB)))
+    return _cache